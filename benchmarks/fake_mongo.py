@@ -0,0 +1,85 @@
+"""
+In-process stand-in for a mongodb client, just enough of pymongo for remote.sync:
+bulk writes of ReplaceOne and UpdateOne($setOnInsert) upserts by _id.
+Documents are BSON encoded like the real driver does before sending them,
+so the sync stage still measures building and encoding the writes.
+"""
+from typing import Any, Dict, List
+
+import bson
+import pymongo
+from pymongo.results import BulkWriteResult
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents: Dict[Any, bytes] = {}
+
+    def bulk_write(self, requests: List, ordered: bool = True) -> BulkWriteResult:
+        upserted, matched, modified = [], 0, 0
+        for index, request in enumerate(requests):
+            # pymongo's write requests keep their arguments private
+            _id = request._filter["_id"]
+            document = _new_document(request)
+            if _id in self.documents:
+                matched += 1
+                if isinstance(request, pymongo.UpdateOne):
+                    # $setOnInsert leaves existing documents alone
+                    continue
+                modified += 1
+            else:
+                upserted.append({"index": index, "_id": _id})
+            self.documents[_id] = bson.BSON.encode(dict(document, _id=_id))
+        result = dict(
+            nInserted=0,
+            nUpserted=len(upserted),
+            nMatched=matched,
+            nModified=modified,
+            nRemoved=0,
+            upserted=upserted,
+        )
+        return BulkWriteResult(result, True)
+
+
+def _new_document(request) -> Dict[str, Any]:
+    document: Any = request._doc
+    if isinstance(request, pymongo.ReplaceOne):
+        return document
+    if isinstance(request, pymongo.UpdateOne) and set(document) == {"$setOnInsert"}:
+        return document["$setOnInsert"]
+    raise NotImplementedError(f"Unsupported write request {request!r}")
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return self._collections.setdefault(name, FakeCollection())
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class FakeMongoClient:
+    def __init__(self):
+        self._databases: Dict[str, FakeDatabase] = {}
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        return self._databases.setdefault(name, FakeDatabase())
+
+    def __getattr__(self, name: str) -> FakeDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def drop_database(self, name: str):
+        self._databases.pop(name, None)
+
+    def __enter__(self) -> "FakeMongoClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
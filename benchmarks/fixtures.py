@@ -0,0 +1,98 @@
+"""
+Deterministic synthetic fixtures: an IMDB title.basics.tsv.gz and a movies directory tree.
+"""
+import gzip
+import os
+import random
+from typing import List, Tuple
+
+HEADERS = [
+    "tconst",
+    "titleType",
+    "primaryTitle",
+    "originalTitle",
+    "isAdult",
+    "startYear",
+    "endYear",
+    "runtimeMinutes",
+    "genres",
+]
+TYPES = ["movie"] * 4 + ["short", "tvEpisode", "tvSeries", "video"]
+GENRES = [
+    "Action",
+    "Adventure",
+    "Comedy",
+    "Crime",
+    "Documentary",
+    "Drama",
+    "Fantasy",
+    "Horror",
+    "Romance",
+    "Sci-Fi",
+    "Thriller",
+    "Western",
+]
+WORDS = (
+    "the of a dark night love last man city war story day house blue red king".split()
+)
+SUBTITLES = {"English": "Hello there, general", "Hebrew": "שלום לך, גנרל"}
+NULL = "\\N"
+
+
+def _title(rng: random.Random, i: int) -> str:
+    words = rng.sample(WORDS, rng.randint(1, 4))
+    return " ".join(words).title() + f" {i}"
+
+
+def _row(rng: random.Random, i: int) -> List[str]:
+    title = _title(rng, i)
+    return [
+        f"tt{i:07d}",
+        rng.choice(TYPES),
+        title,
+        title if rng.random() < 0.9 else f"{title} (original)",
+        "0",
+        str(rng.randint(1920, 2019)),
+        NULL,
+        str(rng.randint(5, 200)) if rng.random() < 0.8 else NULL,
+        ",".join(rng.sample(GENRES, rng.randint(1, 3))),
+    ]
+
+
+def write_titles_tsv_gz(path: str, rows: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=1) as f:
+        f.write("\t".join(HEADERS) + "\n")
+        for i in range(1, rows + 1):
+            f.write("\t".join(_row(rng, i)) + "\n")
+    return path
+
+
+def read_titles(path: str, limit: int) -> List[Tuple[str, int]]:
+    """
+    (title, start_year) of the first limit rows of a titles fixture
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        next(f)
+        rows = (line.rstrip("\n").split("\t") for _, line in zip(range(limit), f))
+        return [(row[2], int(row[5])) for row in rows]
+
+
+def write_movies_tree(
+    path: str, titles: List[Tuple[str, int]], seed: int = 0
+) -> List[str]:
+    """
+    A directory per movie, with a video and 0-2 subtitles files
+    """
+    rng = random.Random(seed)
+    dirs = []
+    for title, start_year in titles:
+        movie_dir = os.path.join(path, f"{title} ({start_year}) [1080p]")
+        os.makedirs(movie_dir, exist_ok=True)
+        open(os.path.join(movie_dir, f"{title}.mkv"), "wb").close()
+        for language in rng.sample(sorted(SUBTITLES), rng.randint(0, 2)):
+            subtitles_path = os.path.join(movie_dir, f"{title}.{language}.srt")
+            with open(subtitles_path, "w", encoding="utf-8") as f:
+                f.write(f"1\n00:00:01,000 --> 00:00:02,000\n{SUBTITLES[language]}\n")
+        dirs.append(movie_dir)
+    return dirs
@@ -0,0 +1,196 @@
+"""
+End to end benchmark over synthetic fixtures.
+Times every stage (import, index, lookup, scan, sync) and stores the results as JSON,
+so runs of different commits can be compared.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from fake_mongo import FakeMongoClient
+from fixtures import read_titles, write_movies_tree, write_titles_tsv_gz
+
+from iamdb import localdb
+from iamdb.watched.local_info import collect_local_info
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+class Timer:
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        self.stages[stage] = time.perf_counter() - start
+        print(f"{stage}: {self.stages[stage]:.3f}s", file=sys.stderr)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _lookup_all(dbpath: str, titles: List, use_index: bool, cold: bool = True):
+    if cold:
+        # Otherwise later stages would only measure the lookup cache
+        localdb.cache_clear()
+    with localdb.connect(dbpath, use_index=use_index) as conn:
+        for title, start_year in titles:
+            try:
+                localdb.fuzzy_find_in_db(title, start_year, conn=conn)
+            except localdb.MovieLookupError:
+                pass
+
+
+def _mongo_client(mongodb_uri: Optional[str]):
+    """
+    A real (preferably local) mongodb when uri is given, otherwise an in-process fake
+    """
+    if mongodb_uri:
+        import pymongo
+
+        return pymongo.MongoClient(mongodb_uri)
+    return FakeMongoClient()
+
+
+def _sync(movies_dirs: List[str], dbpath: str, mongodb_uri: Optional[str]):
+    from iamdb import remote, watched
+
+    with localdb.connect(dbpath) as conn:
+        movies = list(watched.list_movies_dirs(movies_dirs, conn=conn))
+    with _mongo_client(mongodb_uri) as client:
+        remote.sync(client.iamdb_benchmark, movies)
+        client.drop_database("iamdb_benchmark")
+
+
+def run(
+    workdir: str,
+    rows: int,
+    movies: int,
+    seed: int,
+    sync: bool = True,
+    mongodb_uri: Optional[str] = None,
+) -> Dict[str, float]:
+    timer = Timer()
+    tsv_gz_path = os.path.join(workdir, "title.basics.tsv.gz")
+    dbpath = os.path.join(workdir, "imadb.db")
+    movies_dir = os.path.join(workdir, "movies")
+
+    with timer("fixtures"):
+        write_titles_tsv_gz(tsv_gz_path, rows, seed=seed)
+        titles = read_titles(tsv_gz_path, movies)
+        movie_dirs = write_movies_tree(movies_dir, titles, seed=seed)
+
+    with localdb.connect(dbpath, use_index=False) as conn:
+        with timer("import"), contextlib.redirect_stdout(io.StringIO()):
+            localdb.create.create_sqlite_schema(conn=conn)
+            localdb.create.tsv_gz_to_sqlite(tsv_gz_path, conn=conn)
+        with timer("index"):
+            localdb.create.finalize_schema(conn=conn)
+        with timer("mmap_index"):
+            localdb.create.build_index(dbpath, conn=conn)
+
+    with timer("lookup"):
+        _lookup_all(dbpath, titles, use_index=False)
+    with timer("mmap_lookup"):
+        _lookup_all(dbpath, titles, use_index=True)
+    with timer("cached_lookup"):
+        _lookup_all(dbpath, titles, use_index=True, cold=False)
+    with timer("compact"):
+        compact_path = localdb.create.compact(dbpath)
+    with timer("compact_lookup"):
+        _lookup_all(compact_path, titles, use_index=False)
+    with timer("scan"):
+        list(map(collect_local_info, movie_dirs))
+    if sync:
+        _run_optional(timer, "sync", lambda: _sync([movies_dir], dbpath, mongodb_uri))
+    return timer.stages
+
+
+def _run_optional(timer: Timer, stage: str, func: Callable):
+    try:
+        with timer(stage):
+            func()
+    except ImportError as e:
+        print(f"Skipping {stage}: {e}", file=sys.stderr)
+
+
+def compare(base_path: str, head_path: str, threshold: float) -> bool:
+    """
+    Prints head/base ratio for every stage, returns whether any stage regressed.
+    A stage of base missing from head (skipped or failed) is a regression too.
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    regressed = False
+    for stage, base_seconds in base["stages"].items():
+        if stage not in head["stages"]:
+            regressed = True
+            print(f"{stage}: {base_seconds:.3f}s -> missing REGRESSION")
+            continue
+        seconds = head["stages"][stage]
+        ratio = seconds / (base_seconds or float("inf"))
+        mark = " REGRESSION" if ratio > threshold else ""
+        regressed = regressed or bool(mark)
+        print(f"{stage}: {base_seconds:.3f}s -> {seconds:.3f}s ({ratio:.2f}x){mark}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--rows", type=int, default=100_000)
+    run_parser.add_argument("--movies", type=int, default=1000)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="Defaults to results/<commit>.json")
+    run_parser.add_argument("--no-sync", action="store_true", help="Skip sync stage")
+    run_parser.add_argument(
+        "--mongodb-uri", help="Sync against this mongodb instead of an in-process fake"
+    )
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(1 if compare(args.base, args.head, args.threshold) else 0)
+
+    commit = _git_commit()
+    with tempfile.TemporaryDirectory() as workdir:
+        stages = run(
+            workdir,
+            args.rows,
+            args.movies,
+            args.seed,
+            sync=not args.no_sync,
+            mongodb_uri=args.mongodb_uri,
+        )
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        result = dict(commit=commit, rows=args.rows, movies=args.movies, stages=stages)
+        json.dump(result, f, indent=2, sort_keys=True)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
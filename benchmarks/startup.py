@@ -0,0 +1,57 @@
+"""
+Cold start benchmark for the CLI, based on `python -X importtime`.
+Fails when importing iamdb.cli is over budget, or pulls in a heavy backend eagerly.
+"""
+import argparse
+import subprocess
+import sys
+from typing import Dict, List
+
+MODULE = "iamdb.cli"
+LAZY_MODULES = ["pymongo", "keyring", "numpy", "pyarrow", "urllib.request"]
+
+
+def measure_import_times(module: str = MODULE) -> Dict[str, int]:
+    """
+    Cumulative import time (microseconds) of every module imported by module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def check(times: Dict[str, int], budget_ms: float) -> List[str]:
+    errors = [f"{m} is imported eagerly" for m in LAZY_MODULES if m in times]
+    took_ms = times[MODULE] / 1000
+    if took_ms > budget_ms:
+        errors.append(f"import {MODULE} took {took_ms:.1f}ms > {budget_ms}ms budget")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-ms", type=float, default=150)
+    parser.add_argument("--runs", type=int, default=5, help="Best of runs is taken")
+    args = parser.parse_args()
+
+    runs = [measure_import_times() for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times[MODULE])
+    print(f"import {MODULE}: {best[MODULE] / 1000:.1f}ms")
+    errors = check(best, args.budget_ms)
+    for error in errors:
+        print(error, file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
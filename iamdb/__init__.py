@@ -1,4 +1,13 @@
-from . import localdb, remote, watched
+import importlib
+
 from .models import Movie
 
 __all__ = ["localdb", "remote", "watched", "Movie"]
+_submodules = {"localdb", "remote", "watched"}
+
+
+def __getattr__(name: str):
+    # Submodules are imported on first access, keeping `import iamdb` (and CLI startup) cheap
+    if name in _submodules:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,15 +1,21 @@
 from __future__ import annotations
 
 import functools
+import itertools
 import os
+import typing
 from contextlib import contextmanager
-from typing import Iterator, List, Optional
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 import click
 import click_config_file
-import pymongo
 
-from . import config, localdb, passwd, remote, watched
+from . import config, export, localdb, profiling
+
+if typing.TYPE_CHECKING:
+    import pymongo
+
+    from .stats import WatchedColumns
 
 
 def click_ipdb(func):
@@ -118,15 +124,60 @@ def configuration_callback(ctx: click.Context, _, config_path: str):
     type=click.Path(dir_okay=True, file_okay=False, exists=True),
 )
 @click.option("--pdb", is_flag=True, help="Launch ipdb on exception")
+@click.option(
+    "--profile", is_flag=True, help="Print per-stage latency percentiles on exit"
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False),
+    help="Also dump a JSON trace (*.json) or cProfile stats (any other extension)",
+)
 @click.pass_context
 @click_config
-def cli(ctx: click.Context, dbpath: str, movies_dir: List[str], pdb: bool):
-    if not movies_dir:
+def cli(
+    ctx: click.Context,
+    dbpath: str,
+    movies_dir: List[str],
+    pdb: bool,
+    profile: bool,
+    profile_output: Optional[str],
+):
+    if profile or profile_output:
+        _start_profiling(ctx, profile_output)
+    ctx.obj = dict(ctx.obj or {}, dbpath=dbpath, movies_dirs=movies_dir, pdb=pdb)
+
+
+def _get_movies_dirs(ctx: click.Context) -> List[str]:
+    """
+    The movies dirs given to the iamdb group, for the commands that need them
+    """
+    movies_dirs = ctx.obj["movies_dirs"]
+    if not movies_dirs:
         click.echo("No movies directories were given, nothing to do")
         click.echo("Either specify via -m/--movies-dir or add some to config file")
         click.echo("iamdb -m /path/to/movies/dir --write-config")
         raise click.Abort()
-    ctx.obj = dict(ctx.obj or {}, dbpath=dbpath, movies_dirs=movies_dir, pdb=pdb)
+    return list(movies_dirs)
+
+
+def _start_profiling(ctx: click.Context, profile_output: Optional[str]):
+    profiling.enable()
+    profiler = None
+    if profile_output and not profile_output.endswith(".json"):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        click.echo(profiling.format_report(), err=True)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_output)
+        elif profile_output:
+            profiling.dump_json(profile_output)
+
+    ctx.call_on_close(finish)
 
 
 @cli.command("localdb")
@@ -145,11 +196,27 @@ def cli(ctx: click.Context, dbpath: str, movies_dir: List[str], pdb: bool):
     default=localdb.create.IMDB_DATA_TSV_GZ_PATH,
     help="Path to TSV, if not exists will trigger download and delete",
 )
+@click.option(
+    "--index/--no-index",
+    "build_index",
+    default=False,
+    help="Also build a memory mapped lookup index next to the DB",
+)
+@click.option(
+    "--compact/--no-compact",
+    default=False,
+    help="Replace the DB with a smaller read-only copy, reporting size and lookup latency of both",
+)
 @click.pass_context
 @click_ipdb
 @click_config
 def localdb_cli(
-    ctx: click.Context, force_redownload: bool, force_rebuild: bool, tsv_gz_path: str
+    ctx: click.Context,
+    force_redownload: bool,
+    force_rebuild: bool,
+    tsv_gz_path: str,
+    build_index: bool,
+    compact: bool,
 ):
     """
     Generate the local sqlite from the public IMDB TSV
@@ -165,17 +232,47 @@ def localdb_cli(
         tsv_gz_path = localdb.create.download_tsv_gz(path=tsv_gz_path)
         downloaded = True
 
-    with localdb.connect(dbpath) as conn:
+    _import_localdb(dbpath, tsv_gz_path, remove_tsv=downloaded)
+    if compact:
+        click.echo("Compacting")
+        _compact_localdb(dbpath)
+    if build_index:
+        click.echo("Building lookup index")
+        with localdb.connect(dbpath, use_index=False, use_server=False) as conn:
+            localdb.create.build_index(dbpath, conn=conn)
+    click.echo("Done!")
+
+
+def _import_localdb(dbpath: str, tsv_gz_path: str, remove_tsv: bool):
+    if os.path.exists(dbpath):
+        # A compact DB is read-only, and dropping tables doesn't shrink the file anyway
+        os.remove(dbpath)
+    with localdb.connect(dbpath, use_index=False) as conn:
         click.echo("Creating sqlite schema")
         localdb.create.create_sqlite_schema(conn=conn)
         click.echo("Importing tsv into sqlite... This might take a while")
         localdb.create.tsv_gz_to_sqlite(tsv_gz_path, conn=conn)
-        if downloaded:
+        if remove_tsv:
             click.echo("Removing tsv")
             os.remove(tsv_gz_path)
         click.echo("Finalizing schema... This might take a while")
         localdb.create.finalize_schema(conn=conn)
-        click.echo("Done!")
+
+
+def _compact_localdb(dbpath: str):
+    """
+    Replaces the DB with its compact copy, after reporting the difference
+    """
+    compact_path = localdb.create.compact(dbpath)
+    with localdb.connect(dbpath, use_index=False, use_server=False) as conn:
+        keys = localdb.create.sample_lookup_keys(conn=conn)
+    for name, path in (("Regular", dbpath), ("Compact", compact_path)):
+        res = localdb.create.measure_lookups(path, keys)
+        click.echo(
+            f"{name}: {res['size'] / (1 << 20):.1f}MiB, "
+            f"get_by_id {res['get_by_id'] * 1e6:.1f}us, find {res['find'] * 1e6:.1f}us"
+        )
+    os.replace(compact_path, dbpath)
 
 
 @cli.command()
@@ -197,17 +294,285 @@ def localdb_cli(
 @click_config
 def check(ctx: click.Context, interactive: bool, auto_open_web: bool, verbose: bool):
     """
-    Check that all watched movies can resolve IMDB data
+    Check that all watched movies can resolve IMDB data.
+    Failures are remembered (until the localdb is rebuilt) and reported together.
+    """
+    from . import watched
+
+    movies_dirs = _get_movies_dirs(ctx)
+    with localdb.connect(
+        ctx.obj["dbpath"]
+    ) as conn, watched.resolutions.open_resolutions(conn) as resolutions:
+        failures = list(
+            _check_movies_dirs(
+                movies_dirs,
+                verbose=verbose,
+                interactive=interactive,
+                conn=conn,
+                auto_open_web=auto_open_web,
+                resolutions=resolutions,
+            )
+        )
+    _echo_failures(failures)
+    if failures:
+        ctx.exit(1)
+
+
+def _check_movies_dirs(
+    movies_dirs: List[str], *, verbose: bool, **kwargs
+) -> Iterator[Tuple[str, BaseException]]:
+    """
+    Yields the path and lookup error of every movie dir that can't be resolved
+    """
+    from . import watched
+
+    for path in watched.list_movies_paths(movies_dirs):
+        try:
+            movie = watched.collect_full_info(path, **kwargs)
+        except localdb.MovieLookupError as e:
+            yield path, e.__cause__ or e
+            continue
+        if verbose:
+            click.echo(movie)
+
+
+def _echo_failures(failures: Sequence[Tuple[str, BaseException]]):
+    not_found, ambiguous = [], []
+    for path, e in failures:
+        if isinstance(e, localdb.MultipleMoviesFound):
+            ambiguous.append(f"{path}: {', '.join(e.candidates)}")
+        else:
+            not_found.append(path)
+    for title, lines in (("Not found", not_found), ("Ambiguous", ambiguous)):
+        if lines:
+            click.echo(f"{title} ({len(lines)}):")
+            click.echo("\n".join(f"  {line}" for line in lines))
+
+
+@cli.command("scan")
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.pass_context
+@click_ipdb
+@click_config
+def scan_cli(ctx: click.Context, output: str):
+    """
+    Scan the movies dirs into a scan file, to be merged on another host with `iamdb remote merge`.
+    Doesn't need the local IMDB clone.
     """
+    from .watched import scan
+
+    result = scan.scan_movies_dirs(_get_movies_dirs(ctx))
+    scan.save(result, output)
+    click.echo(f"Scanned {len(result.movies)} movies into {output}")
+    for path, error in result.errors.items():
+        click.echo(f"  Skipped {path}: {error}")
+
+
+@cli.command("stats")
+@click.option(
+    "-r",
+    "--rescan",
+    is_flag=True,
+    help="Rescan the movies dirs instead of using the last scan results",
+)
+@click.option(
+    "-u",
+    "--watch-time-unit",
+    type=click.Choice(["Y", "M", "W", "D"]),
+    default="Y",
+    help="Bucket size of the watch time histogram",
+)
+@click.option("--json", "as_json", is_flag=True, help="Output as JSON")
+@click.pass_context
+@click_ipdb
+@click_config
+def stats_cli(ctx: click.Context, rescan: bool, watch_time_unit: str, as_json: bool):
+    """
+    Compute watched movies statistics locally
+    """
+    from . import stats
+
+    columns = _load_watched_columns(ctx, rescan=rescan)
+    summary = stats.summarize(columns, watch_time_unit=watch_time_unit)
+    if as_json:
+        click.echo(config.dumps(summary))
+    else:
+        _echo_summary(summary)
+
+
+def _load_watched_columns(ctx: click.Context, *, rescan: bool) -> WatchedColumns:
+    from . import stats, watched
+
+    movies_dirs = _get_movies_dirs(ctx)
+    snapshot_path = stats.get_snapshot_path()
     with localdb.connect(ctx.obj["dbpath"]) as conn:
-        for movie in watched.list_movies_dirs(
-            ctx.obj["movies_dirs"],
-            interactive=interactive,
-            conn=conn,
-            auto_open_web=auto_open_web,
-        ):
-            if verbose:
-                click.echo(movie)
+        key = stats.snapshot_key(movies_dirs, db_version=conn.version)
+        if not rescan and key and os.path.exists(snapshot_path):
+            try:
+                return stats.load(snapshot_path, key=key)
+            except stats.StaleSnapshot:
+                pass
+        columns = stats.columnize(watched.list_movies_dirs(movies_dirs, conn=conn))
+    stats.save(columns, snapshot_path, key=key or "")
+    return columns
+
+
+def _echo_summary(summary: dict):
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            click.echo(f"{key}:")
+            for subkey, subvalue in value.items():
+                click.echo(f"  {subkey}: {_format_stat(subvalue)}")
+        else:
+            click.echo(f"{key}: {_format_stat(value)}")
+
+
+def _format_stat(value) -> str:
+    return f"{value:.1%}" if isinstance(value, float) else str(value)
+
+
+@cli.command("export")
+@click.argument("path", type=click.Path(file_okay=False))
+@click.option(
+    "--localdb/--no-localdb",
+    "include_localdb",
+    default=False,
+    help="Also export the whole local IMDB movies table",
+)
+@click.option("-a", "--append", is_flag=True, help="Append instead of overwriting")
+@click.option(
+    "--row-group-size",
+    type=int,
+    default=export.DEFAULT_ROW_GROUP_SIZE,
+    help="Number of movies per parquet row group",
+)
+@click.pass_context
+@click_ipdb
+@click_config
+def export_cli(
+    ctx: click.Context,
+    path: str,
+    include_localdb: bool,
+    append: bool,
+    row_group_size: int,
+):
+    """
+    Export watched movies (and optionally local IMDB) as parquet datasets under PATH
+    """
+    from . import watched
+
+    movies_dirs = _get_movies_dirs(ctx)
+    with localdb.connect(ctx.obj["dbpath"]) as conn:
+        datasets = {"watched": watched.list_movies_dirs(movies_dirs, conn=conn)}
+        if include_localdb:
+            datasets["movies"] = localdb.iter_movies(conn=conn)
+        for name, movies in datasets.items():
+            part = export.export_movies(
+                movies,
+                os.path.join(path, name),
+                append=append,
+                row_group_size=row_group_size,
+            )
+            click.echo(f"Exported {name} to {part}")
+
+
+@cli.command("recommend")
+@click.option("-n", "--number", type=int, default=20, help="Number of recommendations")
+@click.option(
+    "-r",
+    "--rescan",
+    is_flag=True,
+    help="Rescan the movies dirs instead of using the last scan results",
+)
+@click.option(
+    "--rebuild-features",
+    is_flag=True,
+    help="Rebuild the features cache, even if it matches the DB version",
+)
+@click.pass_context
+@click_ipdb
+@click_config
+def recommend_cli(
+    ctx: click.Context, number: int, rescan: bool, rebuild_features: bool
+):
+    """
+    Recommend unwatched movies similar to the watched ones
+    """
+    from . import recommend
+
+    watched_ids = _load_watched_columns(ctx, rescan=rescan).ids.tolist()
+    dbpath = ctx.obj["dbpath"]
+    with localdb.connect(dbpath) as conn:
+        features = recommend.load_features(dbpath, conn=conn, rebuild=rebuild_features)
+        try:
+            recommendations = recommend.recommend(features, watched_ids, n=number)
+        except recommend.EmptyProfile as e:
+            raise click.ClickException(str(e)) from e
+        for imdb_id, score in recommendations:
+            click.echo(f"{score:.3f} {localdb.get_by_id(imdb_id, conn=conn)} {imdb_id}")
+
+
+@cli.command("serve")
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    help="Unix socket to listen on, defaults to next to the DB (where the CLI looks)",
+)
+@click.option("--port", type=int, help="Listen on localhost TCP port instead")
+@click.option("--workers", type=int, default=4, help="Number of DB connections")
+@click.option("--cache-size", type=int, default=1 << 16, help="LRU cache entries")
+@click.pass_context
+@click_ipdb
+@click_config
+def serve(
+    ctx: click.Context,
+    socket_path: Optional[str],
+    port: Optional[int],
+    workers: int,
+    cache_size: int,
+):
+    """
+    Serve local IMDB lookups over a socket, other iamdb commands will use it
+    """
+    from .localdb import server
+
+    dbpath = ctx.obj["dbpath"]
+    address = ("127.0.0.1", port) if port else socket_path
+    click.echo(f"Serving {dbpath} on {address or server.get_socket_path(dbpath)}")
+    try:
+        server.serve(dbpath, address, workers=workers, cache_size=cache_size)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command("search")
+@click.argument("title", required=False)
+@click.option("-c", "--contains", help="Substring of the title")
+@click.option("--year-from", type=int, help="Minimal start year")
+@click.option("--year-to", type=int, help="Maximal start year")
+@click.option("-t", "--type", "types", multiple=True, help="Title type, e.g. movie")
+@click.option("-g", "--genre", "genres", multiple=True, help="Required genre")
+@click.option("--min-minutes", type=int, help="Minimal runtime")
+@click.option("--max-minutes", type=int, help="Maximal runtime")
+@click.option("--after", help="Only ids after this one (continue a previous search)")
+@click.option("-n", "--limit", type=int, default=100, help="Maximal number of results")
+@click.option("--page-size", type=int, default=1000)
+@click.pass_context
+@click_ipdb
+@click_config
+def search(
+    ctx: click.Context, title: Optional[str], limit: int, page_size: int, **filters
+):
+    """
+    Search the local IMDB clone, TITLE is a title prefix
+    """
+    with localdb.connect(ctx.obj["dbpath"]) as conn:
+        results = localdb.iter_search(
+            page_size=min(page_size, limit), title=title, conn=conn, **filters
+        )
+        for movie in itertools.islice(results, limit):
+            click.echo(f"{movie.id}\t{movie}\t{movie.type}\t{','.join(movie.genres)}")
 
 
 @cli.group("remote", invoke_without_command=True)
@@ -243,6 +608,8 @@ def remote_cli(
     """
     Sub-commands that handles all remote mongodb operations
     """
+    from . import passwd, remote
+
     password: Optional[str] = None
     if not no_auth:
         password = passwd.resolve_password(
@@ -262,6 +629,8 @@ def remote_cli(
 
 @contextmanager
 def _get_remote_database(ctx: click.Context) -> Iterator[pymongo.database.Database]:
+    from . import remote
+
     with remote.connect(ctx.obj["mongodb_uri"]) as client:
         yield client[ctx.obj["mongodb_database"]]
 
@@ -284,10 +653,15 @@ def sync(ctx, verbose: bool):
     """
     Sync watched movies data to remote mongodb
     """
+    from . import remote, watched
+
+    movies_dirs = _get_movies_dirs(ctx)
     with localdb.connect(ctx.obj["dbpath"]) as conn, _get_remote_database(
         ctx
-    ) as remote_db:
-        movies = list(watched.list_movies_dirs(ctx.obj["movies_dirs"], conn=conn))
+    ) as remote_db, watched.resolutions.open_resolutions(conn) as resolutions:
+        movies = list(
+            watched.list_movies_dirs(movies_dirs, conn=conn, resolutions=resolutions)
+        )
         if verbose:
             click.echo(f"Syncing all {len(movies)} watched movies")
         response = remote.sync(remote_db, movies, replace_existing=True, watched=True)
@@ -304,6 +678,8 @@ def sample(ctx, number: int, verbose: bool):
     """
     Populates the remote DB with a random sample from local IMDB
     """
+    from . import remote
+
     with localdb.connect(ctx.obj["dbpath"]) as conn, _get_remote_database(
         ctx
     ) as remote_db:
@@ -313,9 +689,167 @@ def sample(ctx, number: int, verbose: bool):
         if verbose:
             click.echo(f"Syncing {number} random movies")
         # Don't wanna override watched information
-        response = remote.sync(remote_db, movies, replace_existing=False, watched=True)
+        response = remote.sync(remote_db, movies, replace_existing=False, watched=False)
         _report_bulk_write(response, verbose=verbose)
 
 
+@remote_cli.command("merge")
+@click.argument(
+    "scan_paths", nargs=-1, required=True, type=click.Path(dir_okay=False, exists=True)
+)
+@click.option("-v", "--verbose", is_flag=True)
+@click.pass_context
+@click_ipdb
+@click_config
+def merge(ctx, scan_paths: List[str], verbose: bool):
+    """
+    Resolve the movies of scan files (see `iamdb scan`) and sync them to remote mongodb in one batch
+    """
+    from . import remote, watched
+
+    scans = list(map(watched.scan.load, scan_paths))
+    with localdb.connect(ctx.obj["dbpath"]) as conn, _get_remote_database(
+        ctx
+    ) as remote_db, watched.resolutions.open_resolutions(conn) as resolutions:
+        movies, failures = watched.scan.merge(scans, conn=conn, resolutions=resolutions)
+        if verbose:
+            scanned = sum(len(s.movies) for s in scans)
+            click.echo(
+                f"Syncing {len(movies)} movies from {scanned} scanned movie dirs"
+            )
+        if movies:
+            response = remote.sync(
+                remote_db, movies, replace_existing=True, watched=True
+            )
+            _report_bulk_write(response, verbose=verbose)
+    _echo_failures(failures)
+
+
+@remote_cli.command("indexes")
+@click.option(
+    "--check", "check_only", is_flag=True, help="Only verify, exit 1 if not all ok"
+)
+@click.option(
+    "--rebuild", is_flag=True, help="Drop and recreate indexes with a different spec"
+)
+@click.pass_context
+@click_ipdb
+@click_config
+def indexes(ctx, check_only: bool, rebuild: bool):
+    """
+    Create (and verify) the indexes of the remote movies collection
+    """
+    from . import remote
+
+    with _get_remote_database(ctx) as remote_db:
+        if check_only:
+            status = remote.check_indexes(remote_db)
+        else:
+            status = remote.ensure_indexes(remote_db, rebuild=rebuild)
+    for name, index_status in status.items():
+        click.echo(f"{name}: {index_status}")
+    if check_only and set(status.values()) != {remote.INDEX_OK}:
+        ctx.exit(1)
+
+
+@remote_cli.command("query")
+@click.option("-w", "--watched", is_flag=True, help="Only watched movies")
+@click.option("-t", "--title", help="Exact (normalized) title")
+@click.option("-g", "--genre", "genres", multiple=True, help="Must have all of them")
+@click.option("--year-from", type=int)
+@click.option("--year-to", type=int)
+@click.option(
+    "-f",
+    "--field",
+    "fields",
+    multiple=True,
+    default=["title", "start_year"],
+    show_default=True,
+    help="Fetch only these fields (the id is always fetched)",
+)
+@click.option("-n", "--limit", type=int, default=0, help="0 means no limit")
+@click.option("--batch-size", type=int, default=1000)
+@click.pass_context
+@click_ipdb
+@click_config
+def query(
+    ctx,
+    watched: bool,
+    title: Optional[str],
+    genres: List[str],
+    year_from: Optional[int],
+    year_to: Optional[int],
+    fields: List[str],
+    limit: int,
+    batch_size: int,
+):
+    """
+    Print remote movies as JSON lines, fetching only the needed fields
+    """
+    import json
+
+    from . import remote
+
+    movies_filter = remote.movies_filter(
+        watched=watched or None,
+        title=title,
+        genres=genres,
+        year_from=year_from,
+        year_to=year_to,
+    )
+    with _get_remote_database(ctx) as remote_db:
+        for doc in remote.query(
+            remote_db, movies_filter, fields=fields, limit=limit, batch_size=batch_size
+        ):
+            click.echo(json.dumps(doc, default=str, ensure_ascii=False))
+
+
+@remote_cli.command("watch")
+@click.option(
+    "--debounce",
+    type=float,
+    default=5.0,
+    help="Seconds without changes before syncing a batch",
+)
+@click.option(
+    "--poll-interval",
+    type=float,
+    default=10.0,
+    help="Seconds between scans, when inotify is unavailable",
+)
+@click.option("--polling", is_flag=True, help="Poll even if inotify is available")
+@click.pass_context
+@click_ipdb
+@click_config
+def watch(ctx, debounce: float, poll_interval: float, polling: bool):
+    """
+    Keep syncing changed movies dirs to remote mongodb, until interrupted
+    """
+    from .watched import daemon, resolutions
+
+    movies_dirs = _get_movies_dirs(ctx)
+    source = (
+        daemon.PollingSource(movies_dirs, interval=poll_interval)
+        if polling
+        else daemon.open_source(movies_dirs, poll_interval=poll_interval)
+    )
+    click.echo(f"Watching {', '.join(movies_dirs)} ({type(source).__name__})")
+    with localdb.connect(ctx.obj["dbpath"]) as conn, _get_remote_database(
+        ctx
+    ) as remote_db, resolutions.open_resolutions(conn) as conn_resolutions:
+        watcher = daemon.Watcher(
+            movies_dirs,
+            conn=conn,
+            remote_db=remote_db,
+            debounce=debounce,
+            log=click.echo,
+            resolutions=conn_resolutions,
+        )
+        try:
+            watcher.run(source)
+        except KeyboardInterrupt:
+            watcher.flush()
+
+
 if __name__ == "__main__":
     cli()
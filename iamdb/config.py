@@ -1,8 +1,9 @@
 from __future__ import annotations
 
+import copy
 import json
 import os
-from typing import Any, Mapping, Optional
+from typing import Any, Dict, Mapping, Optional, Tuple
 
 __all__ = [
     "CONFIG_NAME",
@@ -18,6 +19,8 @@ CONFIG_NAME = "iamdb.json"
 CONFIG_DIR = "iamdb"
 Config = Mapping[str, Any]
 _dump_kwargs = dict(indent=2, sort_keys=True)
+# config path -> (mtime, size) of the file when parsed, and its parsed content
+_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
 
 
 def get_config_path(
@@ -30,20 +33,36 @@ def get_config_path(
 
 def initialize(config_path: Optional[str] = None):
     config_path = config_path or get_config_path()
+    if config_path in _cache:
+        # Already loaded, so it exists
+        return
     os.makedirs(os.path.dirname(config_path), exist_ok=True)
     if not os.path.exists(config_path):
         dump({}, config_path)
 
 
 def load(key: Optional[str] = None, config_path: Optional[str] = None) -> Config:
+    """
+    Parses the config once per process, and again only when the file changes
+    """
     config_path = config_path or get_config_path()
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
+    stat = os.stat(config_path)
+    file_id = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(config_path)
+    if cached and cached[0] == file_id:
+        config = cached[1]
+    else:
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        _cache[config_path] = (file_id, config)
+    # Callers may mutate the result, the cache must stay intact
+    config = copy.deepcopy(config)
     return config.get(key, dict()) if key else config
 
 
 def dump(data: Config, config_path: Optional[str] = None):
     config_path = config_path or get_config_path()
+    _cache.pop(config_path, None)
     with open(config_path, "w", encoding="utf-8") as f:
         json.dump(data, f, **_dump_kwargs)  # type: ignore
 
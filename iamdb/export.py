@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import glob
+import itertools
+import os
+import re
+import tempfile
+import typing
+
+from .models import Movie
+
+if typing.TYPE_CHECKING:
+    from typing import Iterable, List, Optional
+
+    import pyarrow as pa
+
+__all__ = ["DEFAULT_ROW_GROUP_SIZE", "schema", "export_movies", "load"]
+DEFAULT_ROW_GROUP_SIZE = 1 << 16
+_PART_PATTERN = "part-*.parquet"
+_PART_NUMBER = re.compile(r"part-(\d+)\.parquet$")
+
+
+def schema() -> pa.Schema:
+    """
+    The arrow schema of exported movies, low cardinality strings are dictionary encoded
+    """
+    import pyarrow as pa
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("type", dictionary),
+            ("title", pa.string()),
+            ("original_title", pa.string()),
+            ("normalized_title", pa.string()),
+            ("is_adult", pa.bool_()),
+            ("start_year", pa.int32()),
+            ("end_year", pa.int32()),
+            ("minutes", pa.int32()),
+            ("genres", pa.list_(dictionary)),
+            ("path", pa.string()),
+            ("quality", dictionary),
+            ("first_watch_time", pa.timestamp("us")),
+            ("subtitles_languages", pa.list_(dictionary)),
+        ]
+    )
+
+
+def export_movies(
+    movies: Iterable[Movie],
+    path: str,
+    *,
+    append: bool = False,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+) -> str:
+    """
+    Streams movies into a new parquet part file under the dataset directory path.
+    Every row_group_size movies are written as a separate row group, so memory stays bounded.
+    Appending adds a new part file, otherwise existing parts are replaced.
+    The dataset is left as it was when movies raises.
+    Returns the path of the written part.
+    """
+    os.makedirs(path, exist_ok=True)
+    parts = _list_parts(path)
+    number = _next_part_number(parts) if append else 0
+    part_path = os.path.join(path, f"part-{number:05d}.parquet")
+    _write_part(movies, part_path, row_group_size)
+    if not append:
+        for part in parts:
+            if os.path.basename(part) != os.path.basename(part_path):
+                os.remove(part)
+    return part_path
+
+
+def _write_part(movies: Iterable[Movie], part_path: str, row_group_size: int):
+    import pyarrow.parquet as pq
+
+    # Dot files are ignored when loading, the part only appears once complete
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".part-", suffix=".tmp", dir=os.path.dirname(part_path)
+    )
+    os.close(fd)
+    try:
+        with pq.ParquetWriter(temp_path, schema()) as writer:
+            for batch in _batches(movies, row_group_size):
+                writer.write_table(batch)
+        os.replace(temp_path, part_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load(path: str, columns: Optional[List[str]] = None) -> pa.Table:
+    """
+    Loads all parts of an exported dataset, memory mapping the files
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, columns=columns, memory_map=True, schema=schema())
+
+
+def _list_parts(path: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(glob.escape(path), _PART_PATTERN)))
+
+
+def _next_part_number(parts: List[str]) -> int:
+    # Not len(parts), that overwrites the last part once an earlier one was removed
+    numbers = [_PART_NUMBER.search(part) for part in parts]
+    return max((int(m.group(1)) + 1 for m in numbers if m), default=0)
+
+
+def _batches(movies: Iterable[Movie], size: int) -> Iterable[pa.Table]:
+    import pyarrow as pa
+
+    iterator = iter(movies)
+    while True:
+        chunk = [m.asdict() for m in itertools.islice(iterator, size)]
+        if not chunk:
+            break
+        yield pa.Table.from_pylist(chunk, schema=schema())
@@ -1,25 +1,58 @@
 from __future__ import annotations
 
+import copy
 import os
 import sqlite3
+import typing
+import urllib.parse
 from contextlib import contextmanager
-from typing import Iterable, Iterator, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
+from .. import profiling
 from ..models import Movie, normalize_title
+from .index import TitleIndex, open_index
+from .lru import LRUCache
+
+if typing.TYPE_CHECKING:
+    from .server import Client
 
 __all__ = [
     "IMDB_TITLES_SQLITE_PATH",
     "MovieLookupError",
     "MovieNotFound",
     "MultipleMoviesFound",
+    "Connection",
     "connect",
     "optional_connect",
     "fuzzy_find_in_db",
     "get_by_id",
     "sample",
+    "iter_movies",
+    "get_db_version",
+    "cache_info",
+    "cache_clear",
+    "search",
+    "iter_search",
 ]
 
 IMDB_TITLES_SQLITE_PATH: str = os.path.join(os.path.expanduser("~"), "imadb.db")
+SAMPLE_QUERY = """
+    SELECT * FROM movies WHERE id IN (
+        SELECT id FROM movies ORDER BY RANDOM() LIMIT ?
+    )"""
+# Lookups keyed on the DB version stamp, so a rebuilt DB never sees stale entries
+_lookup_cache = LRUCache(maxsize=1 << 14)
 
 
 class MovieLookupError(LookupError):
@@ -31,17 +64,72 @@ class MovieNotFound(MovieLookupError):
 
 
 class MultipleMoviesFound(MovieLookupError):
-    pass
+    def __init__(self, message: str, candidates: Sequence[str] = ()):
+        super().__init__(message)
+        self.candidates = list(candidates)
+
 
+class Connection(sqlite3.Connection):
+    """
+    sqlite connection that also carries the version stamp of the DB,
+    the memory mapped index of the DB and a client of the query server of the DB (if any).
+    Lookups prefer the in-process cache, then the index, then the server, then sqlite.
+    """
 
-def connect(*args, **kwargs) -> sqlite3.Connection:
-    conn = sqlite3.connect(*args, **kwargs)
+    version: Optional[int] = None
+    index: Optional[TitleIndex] = None
+    server: Optional[Client] = None
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+        super().close()
+
+
+def connect(
+    database: str,
+    *args,
+    use_index: bool = True,
+    use_server: bool = True,
+    read_only: bool = False,
+    **kwargs,
+) -> Connection:
+    if read_only:
+        uri = f"file:{urllib.parse.quote(database)}?mode=ro"
+        conn = sqlite3.connect(uri, *args, factory=Connection, uri=True, **kwargs)
+    else:
+        conn = sqlite3.connect(database, *args, factory=Connection, **kwargs)
     conn.row_factory = lambda cursor, row: {
         col[0]: value for col, value in zip(cursor.description, row)
     }
+    conn.version = get_db_version(conn)
+    if use_index:
+        conn.index = open_index(database, version=conn.version)
+    if use_server and not conn.index:
+        conn.server = _connect_server(database, version=conn.version)
     return conn
 
 
+def _connect_server(database: str, version: Optional[int]) -> Optional[Client]:
+    from .server import connect_client, get_socket_path
+
+    if not os.path.exists(get_socket_path(database)):
+        return None
+    return connect_client(database, version=version)
+
+
+def get_db_version(conn: sqlite3.Connection) -> Optional[int]:
+    """
+    The version stamp written when the DB was built, None for unversioned DBs
+    """
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row and row["value"]
+
+
 @contextmanager
 def optional_connect(
     conn: Optional[sqlite3.Connection] = None
@@ -70,11 +158,13 @@ def fuzzy_find_in_db(
     Raises exception when no definitive match is found (MovieLookupError).
     """
     with optional_connect(conn) as conn:
-        cursor = conn.execute(
-            "SELECT * FROM movies WHERE normalized_title = ? AND start_year = ?",
-            [normalize_title(title), start_year],
-        )
-        matches = list(map(Movie.from_dict, cursor.fetchall()))
+        key = ("fuzzy_find_in_db", normalize_title(title), start_year)
+        return _cached(conn, key, lambda: _fuzzy_find(title, start_year, conn=conn))
+
+
+def _fuzzy_find(title: str, start_year: int, *, conn: sqlite3.Connection) -> Movie:
+    rows = _find_rows(normalize_title(title), start_year, conn=conn)
+    matches = list(map(Movie.from_dict, rows))
 
     if len(matches) == 1:
         return matches[0]
@@ -87,29 +177,205 @@ def fuzzy_find_in_db(
         return movies[0]
     else:
         raise MultipleMoviesFound(
-            f"{len(matches)} matches (and {len(movies)} movies) found for: {title} ({start_year})"
+            f"{len(matches)} matches (and {len(movies)} movies) found for: {title} ({start_year})",
+            candidates=[m.id for m in movies or matches],
         )
 
 
+@profiling.timed("localdb.find")
+def _find_rows(
+    normalized_title: str, start_year: int, *, conn: sqlite3.Connection
+) -> List[Dict[str, Any]]:
+    conn_index = getattr(conn, "index", None)
+    if conn_index:
+        return conn_index.find(normalized_title, start_year)
+    server = getattr(conn, "server", None)
+    if server:
+        return server.fuzzy_find_in_db(normalized_title, start_year)
+    return conn.execute(
+        "SELECT * FROM movies WHERE normalized_title = ? AND start_year = ?",
+        [normalized_title, start_year],
+    ).fetchall()
+
+
 def get_by_id(imdb_id: str, *, conn: Optional[sqlite3.Connection] = None) -> Movie:
     with optional_connect(conn) as conn:
-        return Movie.from_dict(
-            conn.execute("SELECT * FROM movies WHERE id = ?", [imdb_id]).fetchone()
+        return _cached(
+            conn, ("get_by_id", imdb_id), lambda: _get_by_id(imdb_id, conn=conn)
         )
 
 
+def _get_by_id(imdb_id: str, *, conn: sqlite3.Connection) -> Movie:
+    row = _get_row(imdb_id, conn=conn)
+    if row is None:
+        raise MovieNotFound(f"Could not find id: {imdb_id}")
+    return Movie.from_dict(row)
+
+
+@profiling.timed("localdb.get_by_id")
+def _get_row(imdb_id: str, *, conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+    conn_index = getattr(conn, "index", None)
+    if conn_index:
+        return conn_index.get(imdb_id)
+    server = getattr(conn, "server", None)
+    if server:
+        return server.get_by_id(imdb_id)
+    return conn.execute("SELECT * FROM movies WHERE id = ?", [imdb_id]).fetchone()
+
+
+def _cached(conn: sqlite3.Connection, key: Tuple, lookup: Callable[[], Movie]) -> Movie:
+    """
+    Memoizes lookup (including its MovieLookupError) per DB version.
+    Unversioned DBs can't be invalidated, so they are never cached.
+    """
+    version = getattr(conn, "version", None)
+    if version is None:
+        return lookup()
+    key = (version, *key)
+    try:
+        result = _lookup_cache.get(key)
+        profiling.count("localdb.cache_hit")
+    except KeyError:
+        profiling.count("localdb.cache_miss")
+        result = _lookup_or_error(lookup)
+        _lookup_cache.set(key, result)
+    if isinstance(result, MovieLookupError):
+        # A fresh copy, re-raising the cached one would keep growing its traceback
+        raise copy.copy(result)
+    return result
+
+
+def _lookup_or_error(lookup: Callable[[], Movie]) -> Union[Movie, MovieLookupError]:
+    try:
+        return lookup()
+    except MovieLookupError as e:
+        return e
+
+
+def cache_info() -> Dict[str, Any]:
+    """
+    Hits, misses and size of the in-process lookup cache
+    """
+    return _lookup_cache.info()
+
+
+def cache_clear():
+    _lookup_cache.clear()
+
+
 def sample(n: int, conn: Optional[sqlite3.Connection] = None) -> Iterable[Movie]:
     """
     Provies n random movies from the local IMDB clone
     """
     with optional_connect(conn) as conn:
-        return map(
-            Movie.from_dict,
-            conn.execute(
-                """
-                    SELECT * FROM movies WHERE id IN (
-                        SELECT id FROM movies ORDER BY RANDOM() LIMIT ?
-                    )""",
-                [n],
-            ).fetchall(),
-        )
+        server = getattr(conn, "server", None)
+        if server:
+            return map(Movie.from_dict, server.sample(n))
+        return map(Movie.from_dict, conn.execute(SAMPLE_QUERY, [n]).fetchall())
+
+
+def iter_movies(
+    conn: Optional[sqlite3.Connection] = None, chunk_size: int = 1 << 14
+) -> Iterator[Movie]:
+    """
+    Streams all the movies in the local IMDB clone, fetching chunk_size rows at a time
+    """
+    with optional_connect(conn) as conn:
+        cursor = conn.execute("SELECT * FROM movies")
+        for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+            yield from map(Movie.from_dict, rows)
+
+
+def search(
+    *,
+    title: Optional[str] = None,
+    contains: Optional[str] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    types: Sequence[str] = (),
+    genres: Sequence[str] = (),
+    min_minutes: Optional[int] = None,
+    max_minutes: Optional[int] = None,
+    after: Optional[str] = None,
+    limit: int = 100,
+    conn: Optional[sqlite3.Connection] = None,
+) -> List[Movie]:
+    """
+    A page of movies matching all the given filters, ordered by id.
+    title is a (normalized) prefix, contains is a (normalized) substring, genres must all match.
+    Pass the id of the last movie as after to get the next page (keyset pagination).
+    A single type or year is read in id order from the (type, id) or (start_year, id) index,
+    other filters sort their matches.
+    """
+    conditions = [
+        _title_prefix_condition(title),
+        ("instr(normalized_title, ?) > 0", [normalize_title(contains or "")]),
+        *_year_conditions(year_from, year_to),
+        _in_condition("type", types),
+        *(_genre_condition(genre) for genre in genres),
+        ("minutes >= ?", [min_minutes]),
+        ("minutes <= ?", [max_minutes]),
+        ("id > ?", [after]),
+    ]
+    query, params = _where(conditions)
+    with optional_connect(conn) as conn:
+        rows = conn.execute(
+            f"SELECT * FROM movies {query} ORDER BY id LIMIT ?", [*params, limit]
+        ).fetchall()
+    return list(map(Movie.from_dict, rows))
+
+
+def iter_search(page_size: int = 1000, **filters) -> Iterator[Movie]:
+    """
+    Streams all search results, fetching a page at a time
+    """
+    after = filters.pop("after", None)
+    while True:
+        page = search(after=after, limit=page_size, **filters)
+        yield from page
+        if len(page) < page_size:
+            break
+        after = page[-1].id
+
+
+Condition = Tuple[str, List[Any]]
+
+
+def _where(conditions: Iterable[Condition]) -> Condition:
+    # A condition is skipped when any of its params is None or empty
+    active = [
+        (sql, params)
+        for sql, params in conditions
+        if all(p is not None and p != "" for p in params)
+    ]
+    if not active:
+        return "", []
+    query = " AND ".join(f"({sql})" for sql, _ in active)
+    return f"WHERE {query}", [p for _, params in active for p in params]
+
+
+def _title_prefix_condition(title: Optional[str]) -> Condition:
+    # Range over the normalized_title index, U+10FFFF sorts after any other character
+    prefix = normalize_title(title or "")
+    return (
+        "normalized_title >= ? AND normalized_title < ?",
+        [prefix, prefix and prefix + "\U0010ffff"],
+    )
+
+
+def _year_conditions(
+    year_from: Optional[int], year_to: Optional[int]
+) -> List[Condition]:
+    if year_from is not None and year_from == year_to:
+        # Unlike a range, an equality keeps the (start_year, id) index ordered by id
+        return [("start_year = ?", [year_from])]
+    return [("start_year >= ?", [year_from]), ("start_year <= ?", [year_to])]
+
+
+def _in_condition(column: str, values: Sequence[str]) -> Condition:
+    placeholders = ", ".join("?" for _ in values)
+    return f"{column} IN ({placeholders})", list(values) or [None]
+
+
+def _genre_condition(genre: str) -> Condition:
+    return "id IN (SELECT movie_id FROM movie_genres WHERE genre = ?)", [genre]
@@ -1,22 +1,26 @@
 from __future__ import annotations
 
+import collections
 import gzip
 import itertools
 import os
+import sqlite3
+import stat
 import tempfile
+import time
 import typing
-import urllib.request
 
-from ..models import normalize_title
-from .api import optional_connect
+from ..models import GENRES, encode_genres, normalize_title
+from . import api, index
+from .api import get_db_version, optional_connect
 
 if typing.TYPE_CHECKING:
-    import sqlite3
-    from typing import Optional, Iterable, List, TypeVar
+    from typing import Any, Counter, Dict, Iterable, List, Optional, Tuple, TypeVar
 
     T = TypeVar("T")
 
 IMDB_DATA_TSV_GZ_PATH: str = os.path.join(tempfile.gettempdir(), "titles.basic.tsv.gz")
+_KNOWN_GENRES = frozenset(GENRES)
 
 
 def _chunked(iterable: Iterable[T], chunk_size: int) -> Iterable[List[T]]:
@@ -33,9 +37,23 @@ def _line_to_row(line: str) -> List[Optional[str]]:
     return [None if part == "\\N" else part for part in line.strip().split("\t")]
 
 
+def _normalize_row(row: List, genres_index: int, unknown_genres: Counter[str]) -> tuple:
+    genres = row[genres_index].split(",") if row[genres_index] else []
+    # Genres missing from GENRES have no bit, count them instead of failing the import
+    unknown_genres.update(set(genres) - _KNOWN_GENRES)
+    row[genres_index] = encode_genres(_KNOWN_GENRES.intersection(genres))
+    return (*row, normalize_title(str(row[2])))
+
+
 def create_sqlite_schema(conn: Optional[sqlite3.Connection] = None):
     with optional_connect(conn) as conn:
         conn.execute("DROP TABLE IF EXISTS movies")
+        conn.execute("DROP TABLE IF EXISTS movie_genres")
+        conn.execute("DROP TABLE IF EXISTS genres")
+        conn.execute('CREATE TABLE genres("bit" INTEGER PRIMARY KEY, "name" TEXT)')
+        conn.executemany("INSERT INTO genres VALUES (?, ?)", enumerate(GENRES))
+        conn.execute("DROP TABLE IF EXISTS meta")
+        conn.execute('CREATE TABLE meta("key" TEXT PRIMARY KEY, "value")')
         conn.execute(
             """
             CREATE TABLE movies(
@@ -47,7 +65,7 @@ def create_sqlite_schema(conn: Optional[sqlite3.Connection] = None):
                 "start_year" INT,
                 "end_year" INT,
                 "minutes" INT,
-                "genres" TEXT,
+                "genres" INT,
                 "normalized_title" TEXT
              );"""
         )
@@ -58,9 +76,191 @@ def finalize_schema(conn: Optional[sqlite3.Connection] = None):
         conn.executescript(
             """
             CREATE INDEX normalized_title_start_year ON movies(normalized_title, start_year);
-            CREATE INDEX start_year ON movies(start_year);
+            CREATE INDEX start_year_id ON movies(start_year, id);
+            CREATE INDEX type_id ON movies(type, id);
+            CREATE INDEX type_start_year ON movies(type, start_year);
+            CREATE INDEX minutes ON movies(minutes);
+            CREATE TABLE movie_genres(
+                "genre" TEXT,
+                "movie_id" TEXT,
+                PRIMARY KEY (genre, movie_id)
+            ) WITHOUT ROWID;
+            INSERT INTO movie_genres(genre, movie_id)
+                SELECT genres.name, movies.id FROM movies
+                JOIN genres ON movies.genres & (1 << genres.bit);
+            ANALYZE;
         """
         )
+        stamp_version(conn=conn)
+
+
+def stamp_version(conn: Optional[sqlite3.Connection] = None):
+    """
+    Marks the DB content as new, invalidating everything derived from previous content
+    """
+    with optional_connect(conn) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('version', ?)", [time.time_ns()]
+        )
+        conn.commit()
+
+
+def build_index(dbpath: str, conn: Optional[sqlite3.Connection] = None) -> str:
+    """
+    Writes the memory mapped lookup index next to the DB, returns its path
+    """
+    with optional_connect(conn) as conn:
+        path = index.get_index_path(dbpath)
+        index.build_index(conn, path, version=get_db_version(conn))
+        return path
+
+
+COMPACT_SUFFIX = ".compact"
+COMPACT_PAGE_SIZE = 1024
+# Rebuilds the original columns, ids are tt + at least 7 zero padded digits
+_COMPACT_ID = "printf('tt%07d', num)"
+_COMPACT_SCHEMA = f"""
+    CREATE TABLE meta("key" TEXT PRIMARY KEY, "value");
+    CREATE TABLE genres("bit" INTEGER PRIMARY KEY, "name" TEXT);
+    CREATE TABLE types("code" INTEGER PRIMARY KEY, "name" TEXT UNIQUE);
+    CREATE TABLE titles(
+        "num" INTEGER PRIMARY KEY,
+        "type_code" INT,
+        "title" TEXT,
+        "original_title" TEXT,
+        "is_adult" BOOLEAN,
+        "start_year" INT,
+        "end_year" INT,
+        "minutes" INT,
+        "genres" INT,
+        "normalized_title" TEXT
+    );
+    CREATE TABLE genre_titles(
+        "bit" INT,
+        "num" INT,
+        PRIMARY KEY (bit, num)
+    ) WITHOUT ROWID;
+    CREATE VIEW movies AS SELECT
+        {_COMPACT_ID} AS id,
+        types.name AS type,
+        title,
+        coalesce(original_title, title) AS original_title,
+        is_adult,
+        start_year,
+        end_year,
+        minutes,
+        genres,
+        normalized_title
+    FROM titles LEFT JOIN types ON types.code = titles.type_code;
+    CREATE VIEW movie_genres AS SELECT
+        genres.name AS genre,
+        printf('tt%07d', genre_titles.num) AS movie_id
+    FROM genre_titles JOIN genres USING (bit);
+"""
+_COMPACT_INDEXES = f"""
+    CREATE INDEX id ON titles({_COMPACT_ID});
+    CREATE INDEX normalized_title_start_year ON titles(normalized_title, start_year);
+    CREATE INDEX start_year_id ON titles(start_year, {_COMPACT_ID});
+    CREATE INDEX type_id ON titles(type_code, {_COMPACT_ID});
+    CREATE INDEX type_start_year ON titles(type_code, start_year);
+    CREATE INDEX minutes ON titles(minutes);
+    ANALYZE;
+"""
+
+
+def compact(dbpath: str, compact_path: Optional[str] = None) -> str:
+    """
+    Writes a smaller, read-only copy of the finalized DB, returns its path.
+    Types are interned, ids are stored as integers (without the tt prefix), original titles
+    equal to the title are dropped, and all on small pages.
+    Views with the regular schema (movies and movie_genres) keep it readable as is,
+    an expression index on the rebuilt id keeps id lookups and ordering indexed.
+    """
+    compact_path = compact_path or dbpath + COMPACT_SUFFIX
+    if os.path.exists(compact_path):
+        os.remove(compact_path)
+    compact_conn = sqlite3.connect(compact_path)
+    try:
+        compact_conn.execute(f"PRAGMA page_size = {COMPACT_PAGE_SIZE}")
+        compact_conn.executescript(_COMPACT_SCHEMA)
+        compact_conn.execute("ATTACH DATABASE ? AS source", [dbpath])
+        _check_compact_ids(compact_conn)
+        compact_conn.executescript(
+            """
+            INSERT INTO meta SELECT * FROM source.meta;
+            INSERT INTO genres SELECT * FROM source.genres;
+            INSERT INTO types(name)
+                SELECT DISTINCT type FROM source.movies WHERE type IS NOT NULL ORDER BY type;
+            INSERT INTO titles
+                SELECT
+                    CAST(substr(id, 3) AS INTEGER),
+                    types.code,
+                    title,
+                    NULLIF(original_title, title),
+                    is_adult,
+                    start_year,
+                    end_year,
+                    minutes,
+                    genres,
+                    normalized_title
+                FROM source.movies LEFT JOIN types ON types.name = source.movies.type
+                ORDER BY 1;
+            INSERT INTO genre_titles(bit, num)
+                SELECT genres.bit, titles.num FROM titles
+                JOIN genres ON titles.genres & (1 << genres.bit);
+            """
+        )
+        compact_conn.commit()
+        compact_conn.execute("DETACH DATABASE source")
+        compact_conn.executescript(_COMPACT_INDEXES)
+        compact_conn.execute("VACUUM")
+    except BaseException:
+        compact_conn.close()
+        os.remove(compact_path)
+        raise
+    compact_conn.close()
+    os.chmod(compact_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    return compact_path
+
+
+def _check_compact_ids(compact_conn: sqlite3.Connection):
+    row = compact_conn.execute(
+        "SELECT id FROM source.movies WHERE id != printf('tt%07d', CAST(substr(id, 3) AS INTEGER)) LIMIT 1"
+    ).fetchone()
+    if row:
+        raise ValueError(f"Can't compact id {row[0]!r}, expected tt and digits")
+
+
+def sample_lookup_keys(
+    conn: Optional[sqlite3.Connection] = None, n: int = 1000
+) -> List[Tuple[str, str, int]]:
+    """
+    Random (id, normalized title, start year) triplets, to measure lookups with
+    """
+    with optional_connect(conn) as conn:
+        rows = conn.execute(api.SAMPLE_QUERY, [n]).fetchall()
+    return [(r["id"], r["normalized_title"], r["start_year"]) for r in rows]
+
+
+def measure_lookups(dbpath: str, keys: List[Tuple[str, str, int]]) -> Dict[str, Any]:
+    """
+    File size and mean sqlite latency (seconds) of id and title lookups of keys,
+    bypassing the caches, the memory mapped index and the server
+    """
+    res: Dict[str, Any] = dict(size=os.path.getsize(dbpath))
+    conn = api.connect(dbpath, use_index=False, use_server=False, read_only=True)
+    try:
+        start = time.perf_counter()
+        for imdb_id, _, _ in keys:
+            api._get_row(imdb_id, conn=conn)
+        res["get_by_id"] = (time.perf_counter() - start) / max(len(keys), 1)
+        start = time.perf_counter()
+        for _, normalized_title, start_year in keys:
+            api._find_rows(normalized_title, start_year, conn=conn)
+        res["find"] = (time.perf_counter() - start) / max(len(keys), 1)
+    finally:
+        conn.close()
+    return res
 
 
 COLUMNS_MAPPING = {
@@ -88,10 +288,14 @@ def tsv_gz_to_sqlite(
         rows = map(_line_to_row, fin)
         headers = [COLUMNS_MAPPING[str(h)] for h in next(rows)]
         columns = (*headers, "normalized_title")
+        genres_index = headers.index("genres")
+        unknown_genres: Counter[str] = collections.Counter()
         cur = conn.cursor()
         for i, batch in enumerate(_chunked(rows, chunk_size), 1):
             print(f"Batch #{i}")
-            normalized_batch = [(*row, normalize_title(str(row[2]))) for row in batch]
+            normalized_batch = [
+                _normalize_row(row, genres_index, unknown_genres) for row in batch
+            ]
             print(
                 cur.executemany(
                     "INSERT INTO movies({}) VALUES ({})".format(
@@ -101,10 +305,15 @@ def tsv_gz_to_sqlite(
                 ).fetchall()
             )
         conn.commit()
+    if unknown_genres:
+        skipped = ", ".join(f"{g} ({n})" for g, n in unknown_genres.most_common())
+        print(f"Skipped unknown genres (add them to GENRES): {skipped}")
 
 
 def download_tsv_gz(
     url: str = "https://datasets.imdbws.com/title.basics.tsv.gz",
     path: str = IMDB_DATA_TSV_GZ_PATH,
 ) -> str:
+    import urllib.request
+
     return urllib.request.urlretrieve(url, filename=path)[0]
@@ -0,0 +1,195 @@
+"""
+Memory mapped lookup index over the movies table.
+
+Layout (little endian):
+    header   - magic, db version, rows count, keys position, ids position
+    records  - for every row: uint32 length + compact JSON of the row
+    keys     - sorted hash(normalized_title, start_year) array + parallel records offsets
+    ids      - sorted numeric ids (tt prefix stripped) array + parallel records offsets
+"""
+from __future__ import annotations
+
+import array
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import typing
+
+if typing.TYPE_CHECKING:
+    import sqlite3
+    from typing import Any, BinaryIO, Dict, List, Optional
+
+__all__ = [
+    "INDEX_SUFFIX",
+    "InvalidIndex",
+    "TitleIndex",
+    "get_index_path",
+    "key_hash",
+    "build_index",
+    "open_index",
+]
+INDEX_SUFFIX = ".idx"
+_MAGIC = b"IAMDBIX1"
+_HEADER = struct.Struct("<8sqQQQ")
+_RECORD_LENGTH = struct.Struct("<I")
+_KEY_HASH_FUNCTION = "iamdb_key_hash"
+
+
+class InvalidIndex(ValueError):
+    pass
+
+
+def get_index_path(dbpath: str) -> str:
+    return dbpath + INDEX_SUFFIX
+
+
+def key_hash(normalized_title: Optional[str], start_year: Optional[int]) -> int:
+    """
+    63 bit hash, so it fits in a (signed) sqlite integer
+    """
+    key = f"{normalized_title}\0{start_year}".encode("utf-8")
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, "little") >> 1
+
+
+def _numeric_id(imdb_id: str) -> int:
+    return int(imdb_id[2:]) if imdb_id[2:].isdigit() else -1
+
+
+class TitleIndex:
+    """
+    Read only, zero copy view of an index file.
+    Records are only decoded when returned.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, count, keys_pos, ids_pos = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            self.close()
+            raise InvalidIndex(f"{path} is not an iamdb index")
+        view = memoryview(self._mmap)
+        self._key_hashes = _uint64s(view, keys_pos, count)
+        self._key_offsets = _uint64s(view, keys_pos + 8 * count, count)
+        self._ids = _uint64s(view, ids_pos, count)
+        self._id_offsets = _uint64s(view, ids_pos + 8 * count, count)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def find(self, normalized_title: str, start_year: int) -> List[Dict[str, Any]]:
+        """
+        All rows with exactly the given normalized_title and start_year
+        """
+        h = key_hash(normalized_title, start_year)
+        start = bisect.bisect_left(self._key_hashes, h)
+        end = bisect.bisect_right(self._key_hashes, h, lo=start)
+        rows = (self._record(self._key_offsets[i]) for i in range(start, end))
+        key = (normalized_title, start_year)
+        return [
+            row for row in rows if (row["normalized_title"], row["start_year"]) == key
+        ]
+
+    def get(self, imdb_id: str) -> Optional[Dict[str, Any]]:
+        numeric_id = _numeric_id(imdb_id)
+        i = bisect.bisect_left(self._ids, numeric_id)
+        if i == len(self._ids) or self._ids[i] != numeric_id:
+            return None
+        row = self._record(self._id_offsets[i])
+        return row if row["id"] == imdb_id else None
+
+    def _record(self, offset: int) -> Dict[str, Any]:
+        (length,) = _RECORD_LENGTH.unpack_from(self._mmap, offset)
+        start = offset + _RECORD_LENGTH.size
+        end = start + length
+        return json.loads(self._mmap[start:end])
+
+    def close(self):
+        for attr in ("_key_hashes", "_key_offsets", "_ids", "_id_offsets"):
+            view = self.__dict__.pop(attr, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+
+
+def _uint64s(view: memoryview, position: int, count: int) -> memoryview:
+    end = position + 8 * count
+    return view[position:end].cast("Q")
+
+
+def build_index(conn: sqlite3.Connection, path: str, version: Optional[int] = None):
+    """
+    Writes an index of all rows in the movies table.
+    Sorting is delegated to sqlite, so memory usage is ~16 bytes per row.
+    """
+    conn.create_function(_KEY_HASH_FUNCTION, 2, key_hash)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        ids, id_offsets = _write_records(conn, f)
+        keys_pos = _write_aligned(f, *_sorted_keys(conn, ids, id_offsets))
+        ids_pos = _write_aligned(f, ids, id_offsets)
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, version or 0, len(ids), keys_pos, ids_pos))
+    os.replace(tmp_path, path)
+
+
+def _write_records(conn: sqlite3.Connection, f: BinaryIO):
+    ids, offsets = array.array("Q"), array.array("Q")
+    cursor = conn.execute(
+        "SELECT * FROM movies WHERE id GLOB 'tt[0-9]*' ORDER BY CAST(substr(id, 3) AS INTEGER)"
+    )
+    for rows in iter(lambda: cursor.fetchmany(1 << 14), []):
+        for row in rows:
+            record = json.dumps(row, separators=(",", ":")).encode("utf-8")
+            ids.append(_numeric_id(row["id"]))
+            offsets.append(f.tell())
+            f.write(_RECORD_LENGTH.pack(len(record)))
+            f.write(record)
+    return ids, offsets
+
+
+def _sorted_keys(conn: sqlite3.Connection, ids: array.array, id_offsets: array.array):
+    hashes, offsets = array.array("Q"), array.array("Q")
+    cursor = conn.execute(
+        f"""
+        SELECT CAST(substr(id, 3) AS INTEGER) AS numeric_id,
+               {_KEY_HASH_FUNCTION}(normalized_title, start_year) AS key_hash
+        FROM movies WHERE id GLOB 'tt[0-9]*' ORDER BY key_hash
+        """
+    )
+    for rows in iter(lambda: cursor.fetchmany(1 << 14), []):
+        for row in rows:
+            hashes.append(row["key_hash"])
+            offsets.append(id_offsets[bisect.bisect_left(ids, row["numeric_id"])])
+    return hashes, offsets
+
+
+def _write_aligned(f: BinaryIO, *arrays: array.array) -> int:
+    f.write(b"\0" * (-f.tell() % 8))
+    position = f.tell()
+    for arr in arrays:
+        arr.tofile(f)  # type: ignore
+    return position
+
+
+_opened: Dict[str, TitleIndex] = {}
+
+
+def open_index(dbpath: str, version: Optional[int] = None) -> Optional[TitleIndex]:
+    """
+    Opens (once per process) the index of dbpath.
+    Returns None when there is no index, or it was built for another DB version.
+    """
+    path = get_index_path(dbpath)
+    index = _opened.get(path)
+    if index is None or index.version != version:
+        if not os.path.exists(path):
+            return None
+        index = _opened[path] = TitleIndex(path)
+    return index if index.version == version else None
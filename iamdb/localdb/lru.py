@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+if typing.TYPE_CHECKING:
+    from typing import Any, Dict, Hashable, Optional, Tuple
+
+__all__ = ["LRUCache"]
+
+
+class LRUCache:
+    """
+    Thread safe mapping bounded to maxsize entries (evicting the least recently used),
+    entries optionally expire ttl seconds after being set.
+    Missing and expired keys raise KeyError on get.
+    """
+
+    def __init__(self, maxsize: int = 1 << 14, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+                if expires < time.monotonic():
+                    del self._data[key]
+                    raise KeyError(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        expires = time.monotonic() + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def info(self) -> Dict[str, Any]:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self),
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+        )
@@ -0,0 +1,266 @@
+"""
+Local query server keeping warm read-only connections (and an LRU cache) over the local IMDB clone.
+
+Protocol: newline delimited JSON over a Unix (or TCP) socket.
+A request is {"method": ..., "params": {...}, "version": ...}, or a list of requests (a batch).
+version is the DB version stamp the client expects (optional), when the DB was rebuilt since
+the server opened it, the server reopens it, and refuses requests of any other version.
+A response is {"result": ...} or {"error": {"type": ..., "message": ...}}, or a list of them.
+Methods return raw rows, the MovieLookupError logic stays in api:
+    get_by_id(imdb_id) -> row or null
+    fuzzy_find_in_db(title, start_year) -> rows with the same normalized title and year
+    sample(n) -> rows
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import os
+import signal
+import socket
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from ..models import normalize_title
+from . import api
+
+if typing.TYPE_CHECKING:
+    import sqlite3
+    from typing import Any, Dict, List, Optional, Tuple, Union
+
+    Address = Union[str, Tuple[str, int]]
+
+__all__ = [
+    "SOCKET_SUFFIX",
+    "ServerError",
+    "VersionMismatch",
+    "get_socket_path",
+    "serve",
+    "Client",
+    "connect_client",
+]
+SOCKET_SUFFIX = ".sock"
+_METHODS = ("get_by_id", "fuzzy_find_in_db", "sample")
+
+
+class ServerError(Exception):
+    pass
+
+
+class VersionMismatch(ServerError):
+    pass
+
+
+def get_socket_path(dbpath: str) -> str:
+    return dbpath + SOCKET_SUFFIX
+
+
+class _Handler:
+    """
+    Executes requests on a pool of threads, each with its own read-only connection
+    """
+
+    def __init__(self, dbpath: str, workers: int, cache_size: int):
+        self.dbpath = dbpath
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._cached = functools.lru_cache(maxsize=cache_size)(self._execute)
+        self.version = self._open().version
+
+    def _open(self) -> api.Connection:
+        return api.connect(self.dbpath, read_only=True, use_server=False)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection of an older version still reads the replaced DB file
+        if conn is None or conn.version != self.version:
+            if conn is not None:
+                conn.close()
+            conn = self._local.conn = self._open()
+        return conn
+
+    def _check_version(self, version: Optional[int]):
+        """
+        Reopens the DB when the client expects another version, which must then match
+        """
+        if version is None or version == self.version:
+            return
+        with self._lock:
+            if version != self.version:
+                conn = self._open()
+                conn.close()
+                if conn.version != self.version:
+                    self.version = conn.version
+                    self._cached.cache_clear()
+        if version != self.version:
+            raise VersionMismatch(
+                f"Client expects DB version {version}, server has {self.version}"
+            )
+
+    def _execute(self, method: str, params: str, version: Optional[int]) -> Any:
+        # version is only part of the cache key
+        kwargs = json.loads(params)
+        if method == "get_by_id":
+            return api._get_row(kwargs["imdb_id"], conn=self.conn)
+        if method == "fuzzy_find_in_db":
+            title, start_year = kwargs["title"], kwargs["start_year"]
+            return api._find_rows(normalize_title(title), start_year, conn=self.conn)
+        return self.conn.execute(api.SAMPLE_QUERY, [kwargs["n"]]).fetchall()
+
+    def call(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        method = request.get("method")
+        if method not in _METHODS:
+            return _error(ServerError(f"Unknown method {method!r}"))
+        params = json.dumps(request.get("params", {}), sort_keys=True)
+        try:
+            self._check_version(request.get("version"))
+            # Random samples must not be cached
+            execute = self._execute if method == "sample" else self._cached
+            return {"result": execute(method, params, self.version)}
+        except Exception as e:
+            return _error(e)
+
+    def handle_line(self, line: bytes) -> bytes:
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return _dumps(_error(e))
+        if isinstance(request, list):
+            return _dumps([self.call(r) for r in request])
+        return _dumps(self.call(request))
+
+
+def _error(e: Exception) -> Dict[str, Any]:
+    return {"error": {"type": type(e).__name__, "message": str(e)}}
+
+
+def _dumps(response: Any) -> bytes:
+    return json.dumps(response, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+async def _serve_client(
+    handler: _Handler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+):
+    loop = asyncio.get_event_loop()
+    try:
+        async for line in reader:
+            response = await loop.run_in_executor(
+                handler.executor, handler.handle_line, line
+            )
+            writer.write(response)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def _start_server(handler: _Handler, address: Address):
+    client_connected = functools.partial(_serve_client, handler)
+    if isinstance(address, str):
+        return await asyncio.start_unix_server(
+            client_connected, path=address, limit=1 << 24
+        )
+    host, port = address
+    return await asyncio.start_server(client_connected, host, port, limit=1 << 24)
+
+
+def serve(
+    dbpath: str,
+    address: Optional[Address] = None,
+    *,
+    workers: int = 4,
+    cache_size: int = 1 << 16,
+):
+    """
+    Serves lookups until interrupted, by default on a unix socket next to the DB
+    (where connect() looks for it)
+    """
+    address = address or get_socket_path(dbpath)
+    handler = _Handler(dbpath, workers=workers, cache_size=cache_size)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(_start_server(handler, address))
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        handler.executor.shutdown()
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+
+
+class Client:
+    """
+    Blocking client, a single request at a time
+    """
+
+    def __init__(self, address: Address, version: Optional[int] = None):
+        self.version = version
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(address)
+        except OSError:
+            self._socket.close()
+            raise
+        self._file = self._socket.makefile("rwb")
+
+    def _request(self, request: Any) -> Any:
+        self._file.write(_dumps(request))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ServerError("Server closed the connection")
+        return json.loads(line)
+
+    def _request_of(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {"method": method, "params": params, "version": self.version}
+
+    def call(self, method: str, **params) -> Any:
+        return _result(self._request(self._request_of(method, params)))
+
+    def batch(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+        """
+        Several calls in a single round trip, raises on the first error
+        """
+        requests = [self._request_of(method, params) for method, params in calls]
+        return list(map(_result, self._request(requests)))
+
+    def get_by_id(self, imdb_id: str) -> Optional[Dict[str, Any]]:
+        return self.call("get_by_id", imdb_id=imdb_id)
+
+    def fuzzy_find_in_db(self, title: str, start_year: int) -> List[Dict[str, Any]]:
+        return self.call("fuzzy_find_in_db", title=title, start_year=start_year)
+
+    def sample(self, n: int) -> List[Dict[str, Any]]:
+        return self.call("sample", n=n)
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+def _result(response: Dict[str, Any]) -> Any:
+    if "error" in response:
+        error = response["error"]
+        error_type = (
+            VersionMismatch
+            if error["type"] == VersionMismatch.__name__
+            else ServerError
+        )
+        raise error_type("{type}: {message}".format(**error))
+    return response["result"]
+
+
+def connect_client(dbpath: str, version: Optional[int] = None) -> Optional[Client]:
+    """
+    A client of the server of dbpath (expecting version of the DB), if one is running
+    """
+    try:
+        return Client(get_socket_path(dbpath), version=version)
+    except OSError:
+        return None
@@ -1,9 +1,43 @@
 from __future__ import annotations
 
 import datetime as dt
+import functools
 from dataclasses import asdict as dataclass_asdict
 from dataclasses import dataclass, field, replace
-from typing import Any, Dict, List, Mapping, Optional
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+# All IMDB genres, a genre's bit in a genres mask is its index here (never reorder!)
+GENRES: Tuple[str, ...] = (
+    "Action",
+    "Adult",
+    "Adventure",
+    "Animation",
+    "Biography",
+    "Comedy",
+    "Crime",
+    "Documentary",
+    "Drama",
+    "Family",
+    "Fantasy",
+    "Film-Noir",
+    "Game-Show",
+    "History",
+    "Horror",
+    "Music",
+    "Musical",
+    "Mystery",
+    "News",
+    "Reality-TV",
+    "Romance",
+    "Sci-Fi",
+    "Short",
+    "Sport",
+    "Talk-Show",
+    "Thriller",
+    "War",
+    "Western",
+)
+_GENRE_BITS = {genre: 1 << i for i, genre in enumerate(GENRES)}
 
 
 @dataclass(frozen=True)
@@ -34,11 +68,7 @@ class Movie:
     def from_dict(cls, d: Mapping[str, Any]) -> Movie:
         d = dict(d)
         d.pop("normalized_title", None)
-        d["genres"] = (
-            d["genres"].strip().split(",")
-            if isinstance(d["genres"], str)
-            else (d["genres"] or [])
-        )
+        d["genres"] = _parse_genres(d["genres"])
         d["is_adult"] = bool(int(d["is_adult"]))
         return cls(**d)
 
@@ -59,6 +89,29 @@ class Movie:
         return f"{self.title} ({self.start_year}){quality}"
 
 
+def _parse_genres(genres: Union[None, int, str, List[str]]) -> List[str]:
+    if isinstance(genres, int):
+        return list(decode_genres(genres))
+    if isinstance(genres, str):
+        return genres.strip().split(",")
+    return genres or []
+
+
+def encode_genres(genres: Iterable[str]) -> int:
+    """
+    Packs genres into an integer mask, see GENRES
+    """
+    try:
+        return sum({_GENRE_BITS[genre] for genre in genres})
+    except KeyError as e:
+        raise ValueError(f"Unknown genre {e}, add it to GENRES") from None
+
+
+@functools.lru_cache(maxsize=None)
+def decode_genres(mask: int) -> Tuple[str, ...]:
+    return tuple(genre for genre in GENRES if mask & _GENRE_BITS[genre])
+
+
 def normalize_title(title: str) -> str:
     replacements = {
         "\\": " ",
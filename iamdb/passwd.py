@@ -1,6 +1,10 @@
-from typing import Optional
+import time
+from typing import Dict, Optional, Tuple
 
-import keyring
+# Keyring lookups can be slow (D-Bus), so resolved passwords are kept in memory for a while
+CACHE_TTL = 300.0
+# user -> (expiration time, password)
+_cache: Dict[str, Tuple[float, str]] = {}
 
 
 class CouldNotResolvePassword(Exception):
@@ -41,15 +45,41 @@ def _prompt_for_password(user: str) -> str:
     return click.prompt(f"Password for {user}", hide_input=True)
 
 
-def load(user: str) -> str:
+def load(user: str) -> Optional[str]:
     """
-    Loads the iamdb password for user via keyring
+    Loads the iamdb password for user via keyring (or the in-memory cache)
     """
-    return keyring.get_password("iamdb", user)
+    cached = _get_cached(user)
+    if cached:
+        return cached
+    import keyring
+
+    password = keyring.get_password("iamdb", user)
+    if password:
+        _set_cached(user, password)
+    return password
 
 
 def save(user: str, password: str):
     """
-    Stores the iamdb password for user via keyring
+    Stores the iamdb password for user via keyring, unless it's already there
     """
+    if _get_cached(user) == password:
+        return
+    import keyring
+
     keyring.set_password("iamdb", user, password)
+    _set_cached(user, password)
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def _get_cached(user: str) -> Optional[str]:
+    expires, password = _cache.get(user, (0.0, ""))
+    return password if expires > time.monotonic() else None
+
+
+def _set_cached(user: str, password: str):
+    _cache[user] = (time.monotonic() + CACHE_TTL, password)
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import functools
+import json
+import time
+import typing
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+if typing.TYPE_CHECKING:
+    from typing import Callable, DefaultDict, Dict, Iterator, List, TypeVar
+
+    F = TypeVar("F", bound=Callable)
+
+__all__ = [
+    "PERCENTILES",
+    "enable",
+    "disable",
+    "is_enabled",
+    "reset",
+    "timer",
+    "timed",
+    "count",
+    "report",
+    "format_report",
+    "dump_json",
+]
+PERCENTILES = (50, 90, 99)
+
+_enabled = False
+_timings: DefaultDict[str, List[float]] = defaultdict(list)
+_counters: typing.Counter[str] = Counter()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    _timings.clear()
+    _counters.clear()
+
+
+@contextmanager
+def timer(stage: str) -> Iterator[None]:
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings[stage].append(time.perf_counter() - start)
+
+
+def timed(stage: str) -> Callable[[F], F]:
+    """
+    Decorator version of timer, costs a single global lookup when disabled
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with timer(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    if _enabled:
+        _counters[name] += n
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    rank = round(percentile / 100 * (len(sorted_values) - 1))
+    return sorted_values[rank]
+
+
+def report() -> Dict[str, Dict[str, float]]:
+    """
+    Per stage count, total and latency percentiles (in seconds)
+    """
+    res = {}
+    for stage, timings in _timings.items():
+        timings = sorted(timings)
+        res[stage] = dict(
+            count=len(timings),
+            total=sum(timings),
+            **{f"p{p}": _percentile(timings, p) for p in PERCENTILES},
+            max=timings[-1],
+        )
+    return res
+
+
+def format_report() -> str:
+    lines = []
+    for stage, stats in sorted(report().items()):
+        percentiles = " ".join(
+            f"p{p}={stats[f'p{p}'] * 1000:.2f}ms" for p in PERCENTILES
+        )
+        lines.append(
+            f"{stage}: n={stats['count']} total={stats['total']:.3f}s {percentiles} max={stats['max'] * 1000:.2f}ms"
+        )
+    lines.extend(f"{name}: {value}" for name, value in sorted(_counters.items()))
+    return "\n".join(lines)
+
+
+def dump_json(path: str):
+    """
+    Dumps the raw timings (seconds), counters and report as JSON
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            dict(timings=_timings, counters=_counters, report=report()),
+            f,
+            indent=2,
+            sort_keys=True,
+        )
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import array
+import os
+import sqlite3
+import typing
+from dataclasses import dataclass
+
+from .localdb import get_db_version, optional_connect
+from .models import GENRES
+
+if typing.TYPE_CHECKING:
+    from typing import Iterable, List, Optional, Sequence, Tuple
+
+    import numpy as np
+
+__all__ = [
+    "FEATURES_SUFFIX",
+    "Features",
+    "EmptyProfile",
+    "get_features_path",
+    "build_features",
+    "load_features",
+    "recommend",
+]
+FEATURES_SUFFIX = ".features.npz"
+YEAR_WEIGHT = 1.0
+MINUTES_WEIGHT = 0.5
+
+
+@dataclass(frozen=True)
+class Features:
+    """
+    Feature matrix over localdb movies, rows are L2 normalized so dot product is cosine similarity.
+    Columns are one-hot genres followed by standardized start year and log runtime.
+    """
+
+    version: int
+    ids: np.ndarray
+    names: np.ndarray
+    matrix: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class EmptyProfile(ValueError):
+    pass
+
+
+def get_features_path(dbpath: str) -> str:
+    return dbpath + FEATURES_SUFFIX
+
+
+def _numeric_id(imdb_id: str) -> int:
+    return int(imdb_id[2:])
+
+
+def _imdb_id(numeric_id: int) -> str:
+    return f"tt{numeric_id:07d}"
+
+
+def build_features(
+    conn: Optional[sqlite3.Connection] = None,
+    types: Sequence[str] = ("movie",),
+    chunk_size: int = 1 << 16,
+) -> Features:
+    import numpy as np
+
+    ids, years, minutes = array.array("q"), array.array("d"), array.array("d")
+    genres = array.array("q")
+    with optional_connect(conn) as conn:
+        version = get_db_version(conn) or 0
+        cursor = conn.execute(
+            "SELECT id, start_year, minutes, genres FROM movies WHERE type IN ({})".format(
+                ", ".join("?" for _ in types)
+            ),
+            list(types),
+        )
+        for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+            for row in rows:
+                ids.append(_numeric_id(row["id"]))
+                genres.append(row["genres"] or 0)
+                years.append(row["start_year"] or np.nan)
+                minutes.append(row["minutes"] or np.nan)
+
+    # Unpack the genres masks, bit i is GENRES[i]
+    bits = np.arange(len(GENRES), dtype=np.int64)
+    one_hot = (np.frombuffer(genres, np.int64)[:, None] >> bits & 1).astype(np.float32)
+    numeric = np.stack(
+        [
+            YEAR_WEIGHT * _standardize(np.frombuffer(years)),
+            MINUTES_WEIGHT * _standardize(np.log1p(np.frombuffer(minutes))),
+        ],
+        axis=1,
+    ).astype(np.float32)
+    return Features(
+        version=version,
+        ids=np.frombuffer(ids, np.int64).copy(),
+        names=np.array([*GENRES, "year", "minutes"]),
+        matrix=_normalize_rows(np.hstack([one_hot, numeric])),
+    )
+
+
+def _standardize(values: np.ndarray) -> np.ndarray:
+    """
+    Zero mean, unit variance, missing values become the mean
+    """
+    import numpy as np
+
+    std = np.nanstd(values) or 1.0
+    return np.nan_to_num((values - np.nanmean(values)) / std)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix /= norms
+    return matrix
+
+
+def load_features(
+    dbpath: str, conn: Optional[sqlite3.Connection] = None, rebuild: bool = False
+) -> Features:
+    """
+    Loads the features cached next to the DB, rebuilding them when the DB version changed
+    """
+    import numpy as np
+
+    path = get_features_path(dbpath)
+    with optional_connect(conn) as conn:
+        version = get_db_version(conn) or 0
+        if not rebuild and os.path.exists(path):
+            with np.load(path) as data:
+                if int(data["version"]) == version:
+                    return Features(
+                        version=version,
+                        ids=data["ids"],
+                        names=data["names"],
+                        matrix=data["matrix"],
+                    )
+        features = build_features(conn)
+    with open(path, "wb") as f:
+        np.savez(f, **features.__dict__)
+    return features
+
+
+def _profile(features: Features, watched_ids: np.ndarray) -> np.ndarray:
+    import numpy as np
+
+    watched_rows = np.isin(features.ids, watched_ids)
+    if not watched_rows.any():
+        raise EmptyProfile(
+            f"None of the {len(watched_ids)} watched movies is in the local IMDB clone,"
+            " can't build a profile"
+        )
+    profile = features.matrix[watched_rows].mean(axis=0)
+    return profile / (np.linalg.norm(profile) or 1.0)
+
+
+def recommend(
+    features: Features,
+    watched_ids: Iterable[str],
+    n: int = 20,
+    batch_size: int = 1 << 20,
+) -> List[Tuple[str, float]]:
+    """
+    Top n (imdb id, score) of the unwatched movies most similar to the watched profile.
+    Scoring is done in batches of rows to bound temporary memory.
+    Raises EmptyProfile when none of the watched movies has features.
+    """
+    import numpy as np
+
+    watched = np.array([_numeric_id(i) for i in watched_ids], dtype=np.int64)
+    profile = _profile(features, watched)
+    best_ids, best_scores = np.empty(0, np.int64), np.empty(0, np.float32)
+    for start in range(0, len(features), batch_size):
+        stop = start + batch_size
+        ids, scores = features.ids[start:stop], features.matrix[start:stop] @ profile
+        scores[np.isin(ids, watched)] = -np.inf
+        top = _top(scores, n)
+        best_ids = np.concatenate([best_ids, ids[top]])
+        best_scores = np.concatenate([best_scores, scores[top]])
+        top = _top(best_scores, n)
+        best_ids, best_scores = best_ids[top], best_scores[top]
+    return [
+        (_imdb_id(i), s)
+        for i, s in zip(best_ids.tolist(), best_scores.tolist())
+        if s != -np.inf
+    ]
+
+
+def _top(scores: np.ndarray, n: int) -> np.ndarray:
+    """
+    Indices of the n highest scores, sorted descending
+    """
+    import numpy as np
+
+    if len(scores) > n:
+        candidates = np.argpartition(-scores, n)[:n]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
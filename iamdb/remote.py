@@ -1,12 +1,43 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, Optional, Union
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
 from urllib.parse import quote_plus
 
 import pymongo
 
-from . import config, passwd
-from .models import Movie
+from . import config, passwd, profiling
+from .models import Movie, normalize_title
+
+_WATCHED = {"watched": True}
+# Lookups over everything (including sampled titles), the rest only over watched movies
+INDEXES = (
+    pymongo.IndexModel(
+        [("normalized_title", pymongo.ASCENDING), ("start_year", pymongo.ASCENDING)],
+        name="normalized_title_start_year",
+    ),
+    pymongo.IndexModel(
+        [("start_year", pymongo.ASCENDING)],
+        name="watched_start_year",
+        partialFilterExpression=_WATCHED,
+    ),
+    pymongo.IndexModel(
+        [("genres", pymongo.ASCENDING), ("start_year", pymongo.ASCENDING)],
+        name="watched_genres_start_year",
+        partialFilterExpression=_WATCHED,
+    ),
+    pymongo.IndexModel(
+        [("first_watch_time", pymongo.DESCENDING)],
+        name="watched_first_watch_time",
+        partialFilterExpression=_WATCHED,
+    ),
+)
+INDEX_OK = "ok"
+INDEX_MISSING = "missing"
+INDEX_MISMATCH = "mismatch"
+INDEX_CREATED = "created"
+INDEX_DROPPED = "dropped"
+# No longer in INDEXES, dropped on rebuild
+_OBSOLETE_INDEXES = ("genres_start_year",)
 
 
 def to_doc(movie: Movie) -> Dict[str, Any]:
@@ -27,8 +58,126 @@ def sync(
     **extras,
 ) -> pymongo.results.BulkWriteResult:
 
-    ops = list(map(_movie_to_operation, movies))
-    return db.movies.bulk_write(ops, ordered=False)
+    ops = [
+        _movie_to_operation(movie, replace_existing=replace_existing, **extras)
+        for movie in movies
+    ]
+    with profiling.timer("remote.bulk_write"):
+        return db.movies.bulk_write(ops, ordered=False)
+
+
+def unwatch(
+    db: pymongo.database.Database, imdb_ids: Iterable[str]
+) -> pymongo.results.UpdateResult:
+    """
+    Marks movies as no longer watched, keeping their IMDB data
+    """
+    with profiling.timer("remote.unwatch"):
+        return db.movies.update_many(
+            {"_id": {"$in": list(imdb_ids)}}, {"$set": {"watched": False}}
+        )
+
+
+def check_indexes(db: pymongo.database.Database) -> Dict[str, str]:
+    """
+    Status of every index in INDEXES: ok, missing or mismatch (same name, other spec)
+    """
+    existing = db.movies.index_information()
+    res = {}
+    for index in INDEXES:
+        expected = index.document
+        actual = existing.get(expected["name"])
+        if actual is None:
+            res[expected["name"]] = INDEX_MISSING
+        elif _index_spec(actual) != _index_spec(expected):
+            res[expected["name"]] = INDEX_MISMATCH
+        else:
+            res[expected["name"]] = INDEX_OK
+    return res
+
+
+def ensure_indexes(
+    db: pymongo.database.Database, *, rebuild: bool = False
+) -> Dict[str, str]:
+    """
+    Creates the missing INDEXES (and recreates mismatched ones and drops obsolete ones
+    if rebuild), returns the status of every index, created for the ones just created
+    """
+    status = check_indexes(db)
+    if rebuild:
+        status.update(_drop_obsolete_indexes(db))
+        for name, index_status in status.items():
+            if index_status == INDEX_MISMATCH:
+                db.movies.drop_index(name)
+    recreated = {INDEX_MISSING, INDEX_MISMATCH} if rebuild else {INDEX_MISSING}
+    to_create = [i for i in INDEXES if status[i.document["name"]] in recreated]
+    if to_create:
+        with profiling.timer("remote.create_indexes"):
+            db.movies.create_indexes(to_create)
+    return dict(status, **{i.document["name"]: INDEX_CREATED for i in to_create})
+
+
+def _drop_obsolete_indexes(db: pymongo.database.Database) -> Dict[str, str]:
+    existing = db.movies.index_information()
+    obsolete = [name for name in _OBSOLETE_INDEXES if name in existing]
+    for name in obsolete:
+        db.movies.drop_index(name)
+    return {name: INDEX_DROPPED for name in obsolete}
+
+
+def _index_spec(index: Dict[str, Any]) -> tuple:
+    key = index["key"]
+    key = key.items() if isinstance(key, dict) else key
+    return (
+        [(field, int(direction)) for field, direction in key],
+        index.get("partialFilterExpression"),
+    )
+
+
+def movies_filter(
+    *,
+    watched: Optional[bool] = None,
+    title: Optional[str] = None,
+    genres: Sequence[str] = (),
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    A filter that can use INDEXES, title is matched by its normalized form
+    and genres must all match.
+    """
+    res: Dict[str, Any] = {}
+    if watched is not None:
+        res["watched"] = watched
+    if title:
+        res["normalized_title"] = normalize_title(title)
+    if genres:
+        res["genres"] = {"$all": list(genres)}
+    years = {"$gte": year_from, "$lte": year_to}
+    years = {op: year for op, year in years.items() if year is not None}
+    if years:
+        res["start_year"] = years
+    return res
+
+
+def query(
+    db: pymongo.database.Database,
+    filter: Optional[Dict[str, Any]] = None,
+    *,
+    fields: Sequence[str] = (),
+    sort: Optional[List[tuple]] = None,
+    limit: int = 0,
+    batch_size: int = 1000,
+) -> pymongo.cursor.Cursor:
+    """
+    Movies documents matching filter, with only the given fields (and _id) when given,
+    fetched batch_size documents per round trip
+    """
+    projection = {field: True for field in fields} or None
+    cursor = db.movies.find(filter or {}, projection, limit=limit)
+    if sort:
+        cursor = cursor.sort(sort)
+    return cursor.batch_size(batch_size)
 
 
 def _movie_to_operation(
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import json
+import os
+import typing
+from dataclasses import dataclass
+
+from .models import Movie
+
+if typing.TYPE_CHECKING:
+    from typing import Any, Dict, Iterable, List, Optional
+
+    import numpy as np
+
+__all__ = [
+    "STATS_SNAPSHOT_NAME",
+    "WatchedColumns",
+    "StaleSnapshot",
+    "get_snapshot_path",
+    "snapshot_key",
+    "columnize",
+    "save",
+    "load",
+    "count_by_genre",
+    "count_by_year",
+    "count_by_decade",
+    "total_minutes",
+    "watch_time_histogram",
+    "subtitles_coverage",
+    "summarize",
+]
+STATS_SNAPSHOT_NAME = "watched.npz"
+_SNAPSHOT_KEY = "snapshot_key"
+
+
+@dataclass(frozen=True)
+class WatchedColumns:
+    """
+    Columnar (one array per field) view of the watched movies, joined with localdb.
+    Missing minutes are NaN and missing watch times are NaT.
+    """
+
+    ids: np.ndarray
+    start_year: np.ndarray
+    minutes: np.ndarray
+    first_watch_time: np.ndarray
+    genre_names: np.ndarray
+    genres: np.ndarray
+    subtitles_names: np.ndarray
+    subtitles: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class StaleSnapshot(ValueError):
+    pass
+
+
+def get_snapshot_path(snapshot_name: str = STATS_SNAPSHOT_NAME) -> str:
+    import click
+
+    from .config import CONFIG_DIR
+
+    return os.path.join(click.get_app_dir(CONFIG_DIR), snapshot_name)
+
+
+def snapshot_key(
+    movies_dirs: Iterable[str], db_version: Optional[int]
+) -> Optional[str]:
+    """
+    What a snapshot is scanned from: the movies dirs (adding or removing a movie dir changes
+    their mtime) and the localdb version. None for unversioned DBs, which can't be snapshotted.
+    """
+    if db_version is None:
+        return None
+    dirs = sorted(os.path.abspath(d) for d in movies_dirs)
+    return json.dumps(
+        dict(dirs={d: os.stat(d).st_mtime_ns for d in dirs}, db=db_version)
+    )
+
+
+def columnize(movies: Iterable[Movie]) -> WatchedColumns:
+    import numpy as np
+
+    movies = list(movies)
+    genre_names = sorted({g for m in movies for g in m.genres})
+    subtitles_names = sorted({s for m in movies for s in m.subtitles_languages})
+    return WatchedColumns(
+        ids=np.array([m.id for m in movies], dtype=str),
+        start_year=np.array([m.start_year for m in movies], dtype=np.int32),
+        minutes=np.array(
+            [np.nan if m.minutes is None else m.minutes for m in movies],
+            dtype=np.float64,
+        ),
+        first_watch_time=np.array(
+            [m.first_watch_time or "NaT" for m in movies], dtype="datetime64[s]"
+        ),
+        genre_names=np.array(genre_names, dtype=str),
+        genres=_one_hot([m.genres for m in movies], genre_names),
+        subtitles_names=np.array(subtitles_names, dtype=str),
+        subtitles=_one_hot([m.subtitles_languages for m in movies], subtitles_names),
+    )
+
+
+def _one_hot(values: List[List[str]], names: List[str]) -> np.ndarray:
+    import numpy as np
+
+    positions = {name: i for i, name in enumerate(names)}
+    matrix = np.zeros((len(values), len(names)), dtype=bool)
+    for row, row_values in enumerate(values):
+        matrix[row, [positions[v] for v in row_values]] = True
+    return matrix
+
+
+def save(columns: WatchedColumns, path: Optional[str] = None, key: str = ""):
+    """
+    Stores the columns (and the snapshot_key they were scanned from) as an uncompressed .npz,
+    so loading it is mostly a memcpy
+    """
+    import numpy as np
+
+    path = path or get_snapshot_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays: Dict[str, Any] = dict(columns.__dict__, **{_SNAPSHOT_KEY: np.array(key)})
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def load(path: Optional[str] = None, key: Optional[str] = None) -> WatchedColumns:
+    """
+    Raises StaleSnapshot when given a key other than the one the snapshot was saved with
+    """
+    import numpy as np
+
+    path = path or get_snapshot_path()
+    with np.load(path) as data:
+        if key is not None and data.get(_SNAPSHOT_KEY, np.array("")).item() != key:
+            raise StaleSnapshot(f"{path} was scanned from other movies dirs or localdb")
+        return WatchedColumns(
+            **{name: data[name] for name in data.files if name != _SNAPSHOT_KEY}
+        )
+
+
+def _value_counts(values: np.ndarray) -> Dict[int, int]:
+    import numpy as np
+
+    keys, counts = np.unique(values, return_counts=True)
+    return dict(zip(keys.tolist(), counts.tolist()))
+
+
+def count_by_genre(columns: WatchedColumns) -> Dict[str, int]:
+    counts = columns.genres.sum(axis=0)
+    return dict(zip(columns.genre_names.tolist(), counts.tolist()))
+
+
+def count_by_year(columns: WatchedColumns) -> Dict[int, int]:
+    return _value_counts(columns.start_year)
+
+
+def count_by_decade(columns: WatchedColumns) -> Dict[int, int]:
+    return _value_counts(columns.start_year // 10 * 10)
+
+
+def total_minutes(columns: WatchedColumns) -> int:
+    import numpy as np
+
+    return int(np.nansum(columns.minutes))
+
+
+def watch_time_histogram(columns: WatchedColumns, unit: str = "Y") -> Dict[str, int]:
+    """
+    Counts first watches per time bucket, unit is a numpy datetime unit (Y, M, W, D)
+    """
+    import numpy as np
+
+    times = columns.first_watch_time
+    buckets = times[~np.isnat(times)].astype(f"datetime64[{unit}]")
+    keys, counts = np.unique(buckets, return_counts=True)
+    return dict(zip(map(str, keys), counts.tolist()))
+
+
+def subtitles_coverage(columns: WatchedColumns) -> Dict[str, float]:
+    """
+    Fraction of watched movies that have subtitles in each language (and in none)
+    """
+    if not len(columns):
+        return {}
+    coverage = columns.subtitles.mean(axis=0)
+    res = dict(zip(columns.subtitles_names.tolist(), coverage.tolist()))
+    res["None"] = float((~columns.subtitles.any(axis=1)).mean())
+    return res
+
+
+def summarize(columns: WatchedColumns, watch_time_unit: str = "Y") -> Dict[str, object]:
+    return {
+        "count": len(columns),
+        "total_minutes": total_minutes(columns),
+        "by_genre": count_by_genre(columns),
+        "by_year": count_by_year(columns),
+        "by_decade": count_by_decade(columns),
+        "watch_time": watch_time_histogram(columns, unit=watch_time_unit),
+        "subtitles_coverage": subtitles_coverage(columns),
+    }
@@ -1,4 +1,12 @@
-from . import cache, local_info
-from .full_info import list_movies_dirs
+from . import cache, local_info, resolutions, scan
+from .full_info import collect_full_info, list_movies_dirs, list_movies_paths
 
-__all__ = ["cache", "local_info", "list_movies_dirs"]
+__all__ = [
+    "cache",
+    "local_info",
+    "resolutions",
+    "scan",
+    "collect_full_info",
+    "list_movies_dirs",
+    "list_movies_paths",
+]
@@ -29,6 +29,12 @@ def update(info: dict, movie_dir_path: str):
 
 
 def cache_imdb_id(imdb_id: str, movie_dir_path: str):
+    try:
+        if load_imdb_id(movie_dir_path) == imdb_id:
+            # Don't rewrite (possibly over the network) an unchanged cache
+            return
+    except (OSError, ValueError, KeyError):
+        pass
     update({"id": imdb_id}, movie_dir_path)
 
 
@@ -0,0 +1,347 @@
+"""
+Long running watcher of movies dirs, pushing only changed movies to remote mongodb.
+Uses inotify on Linux (via ctypes, no extra dependency) and falls back to polling elsewhere.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+import typing
+
+from .. import profiling
+from ..localdb import MovieLookupError
+from .cache import CACHE_FILE_NAME
+from .full_info import _list_movies_dirs, collect_full_info
+from .local_info import MovieDirNameParseError
+from .resolutions import save as save_resolutions
+
+if typing.TYPE_CHECKING:
+    import sqlite3
+    from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+    import pymongo
+
+    from ..models import Movie
+    from .resolutions import Resolutions
+
+    Event = Tuple[str, str]
+
+__all__ = [
+    "ADDED",
+    "REMOVED",
+    "MODIFIED",
+    "InotifySource",
+    "PollingSource",
+    "open_source",
+    "Watcher",
+]
+ADDED = "added"
+REMOVED = "removed"
+# Files written, moved or deleted inside a movie dir
+MODIFIED = "modified"
+
+_IN_CLOSE_WRITE = 0x08
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_EVENT = struct.Struct("iIII")
+_IN_EVENT_KINDS = {
+    _IN_CREATE: ADDED,
+    _IN_MOVED_TO: ADDED,
+    _IN_DELETE: REMOVED,
+    _IN_MOVED_FROM: REMOVED,
+}
+_IN_CONTENTS_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_DELETE | _IN_MOVED_FROM
+
+
+class InotifySource:
+    """
+    Events about movie dirs created, removed or renamed directly under the movies dirs,
+    and about files written, moved or deleted inside the movie dirs
+    """
+
+    def __init__(self, movies_dirs: Iterable[str]):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_ONLYDIR | sum(_IN_EVENT_KINDS)
+        self._dirs: Dict[int, str] = {}
+        self._movie_dirs: Dict[int, str] = {}
+        for movies_dir in movies_dirs:
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(movies_dir), mask)
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), f"Can't watch {movies_dir}")
+            self._dirs[wd] = movies_dir
+            for path in _list_movies_dirs(movies_dir):
+                self._watch_contents(path)
+
+    def _watch_contents(self, path: str):
+        mask = _IN_ONLYDIR | _IN_CONTENTS_MASK
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        # Out of watches, or already gone: the watcher still waits for contents to settle
+        if wd >= 0:
+            self._movie_dirs[wd] = path
+
+    def _unwatch_contents(self, path: str):
+        for wd, movie_dir in list(self._movie_dirs.items()):
+            if movie_dir == path:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._movie_dirs[wd]
+
+    def wait(self, timeout: float) -> List[Event]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        return self._read() if readable else []
+
+    def _read(self) -> List[Event]:
+        data = os.read(self._fd, 1 << 16)
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            end = offset + length
+            name = os.fsdecode(data[offset:end].rstrip(b"\0"))
+            offset = end
+            event = self._event(wd, mask, name)
+            if event:
+                events.append(event)
+        return events
+
+    def _event(self, wd: int, mask: int, name: str) -> Optional[Event]:
+        if wd in self._movie_dirs:
+            return self._contents_event(wd, mask, name)
+        kind = _IN_EVENT_KINDS.get(mask & ~_IN_ISDIR)
+        if not (kind and mask & _IN_ISDIR and wd in self._dirs):
+            return None
+        path = os.path.join(self._dirs[wd], name)
+        if kind == ADDED:
+            self._watch_contents(path)
+        else:
+            self._unwatch_contents(path)
+        return kind, path
+
+    def _contents_event(self, wd: int, mask: int, name: str) -> Optional[Event]:
+        if mask & _IN_IGNORED:
+            # The movie dir was deleted, the kernel already dropped its watch
+            del self._movie_dirs[wd]
+            return None
+        if name == CACHE_FILE_NAME:
+            # Written by resolving the movie dir, it would be resolved again forever
+            return None
+        return MODIFIED, self._movie_dirs[wd]
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingSource:
+    """
+    Same events as InotifySource, by diffing the movies dirs listings every interval
+    """
+
+    def __init__(self, movies_dirs: Iterable[str], interval: float = 10.0):
+        self._movies_dirs = list(movies_dirs)
+        self._interval = interval
+        self._known = self._list()
+        self._listed_at = time.monotonic()
+
+    def _list(self) -> Set[str]:
+        return {
+            d for movies_dir in self._movies_dirs for d in _list_movies_dirs(movies_dir)
+        }
+
+    def wait(self, timeout: float) -> List[Event]:
+        # Listing (possibly over the network) only once every interval, however often called
+        until_listing = self._listed_at + self._interval - time.monotonic()
+        if until_listing > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(until_listing, 0))
+        current = self._list()
+        self._listed_at = time.monotonic()
+        events = [(ADDED, path) for path in sorted(current - self._known)]
+        events += [(REMOVED, path) for path in sorted(self._known - current)]
+        self._known = current
+        return events
+
+    def close(self):
+        pass
+
+
+def open_source(movies_dirs: Iterable[str], poll_interval: float = 10.0):
+    movies_dirs = list(movies_dirs)
+    try:
+        return InotifySource(movies_dirs)
+    except (OSError, AttributeError):
+        # No inotify (not Linux, or out of watches)
+        return PollingSource(movies_dirs, interval=poll_interval)
+
+
+class Watcher:
+    """
+    Keeps the scan state (movie dir -> IMDB id) in memory, and syncs debounced batches of
+    changed movie dirs to remote mongodb.
+    """
+
+    def __init__(
+        self,
+        movies_dirs: Iterable[str],
+        *,
+        conn: sqlite3.Connection,
+        remote_db: pymongo.database.Database,
+        debounce: float = 5.0,
+        log: Callable[[str], None] = print,
+        resolutions: Optional[Resolutions] = None,
+    ):
+        self.movies_dirs = list(movies_dirs)
+        self.conn = conn
+        self.resolutions = resolutions
+        self.remote_db = remote_db
+        self.debounce = debounce
+        self.log = log
+        self.known: Dict[str, str] = {}
+        self._pending: Dict[str, str] = {}
+        # Contents of the pending movie dirs when they last changed
+        self._contents: Dict[str, Optional[FrozenSet]] = {}
+        # Removed movies, until remote unwatches them
+        self._unwatched: Set[str] = set()
+        self._last_event = 0.0
+
+    def initial_sync(self):
+        paths = [p for d in self.movies_dirs for p in _list_movies_dirs(d)]
+        self._sync_or_retry(self._resolve(paths))
+
+    def handle(self, events: Iterable[Event]):
+        for kind, path in events:
+            # Later events override earlier ones, a quick delete+create is an update
+            self._pending[path] = kind
+            if kind == REMOVED:
+                self._contents.pop(path, None)
+            else:
+                self._contents[path] = _contents_signature(path)
+            self._last_event = time.monotonic()
+
+    def flush_if_settled(self):
+        if self._pending or self._unwatched:
+            if time.monotonic() - self._last_event >= self.debounce:
+                self.flush()
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        changed = self._settled(p for p, kind in pending.items() if kind != REMOVED)
+        added = self._resolve(changed)
+        removed = [p for p, kind in pending.items() if kind == REMOVED]
+        self._unwatched |= {self.known.pop(p) for p in removed if p in self.known}
+        # A rename removes and adds the same movie, it's still watched
+        self._unwatched -= {movie.id for movie in added}
+        self._sync_or_retry(added)
+        if self._unwatched and self._unwatch(self._unwatched):
+            self._unwatched = set()
+
+    def _settled(self, paths: Iterable[str]) -> List[str]:
+        """
+        The movie dirs whose contents didn't change since their last event,
+        the others (e.g. still being copied) are postponed to the next flush
+        """
+        settled = []
+        for path in paths:
+            contents = _contents_signature(path)
+            if contents == self._contents.get(path):
+                settled.append(path)
+            else:
+                self.handle([(MODIFIED, path)])
+        for path in settled:
+            self._contents.pop(path, None)
+        return settled
+
+    def run(self, source, tick: float = 1.0):
+        self.initial_sync()
+        try:
+            while True:
+                self.handle(source.wait(tick))
+                self.flush_if_settled()
+        finally:
+            source.close()
+
+    def _resolve(self, paths: Iterable[str]) -> List[Movie]:
+        movies = []
+        for path in paths:
+            try:
+                movie = collect_full_info(
+                    path, conn=self.conn, resolutions=self.resolutions
+                )
+            except (MovieLookupError, MovieDirNameParseError, OSError) as e:
+                self.log(f"Skipping {path}: {e}")
+                continue
+            self.known[path] = movie.id
+            movies.append(movie)
+        if self.resolutions and self.resolutions.dirty:
+            # Long running, don't wait for exit to persist new resolutions
+            save_resolutions(self.resolutions)
+        return movies
+
+    def _sync_or_retry(self, movies: List[Movie]):
+        if movies and not self._sync(movies):
+            # Resolved again (from the cache) and retried on the next flush
+            self.handle((ADDED, movie.path) for movie in movies if movie.path)
+
+    def _sync(self, movies: List[Movie]) -> bool:
+        from pymongo.errors import PyMongoError
+
+        from .. import remote
+
+        try:
+            with profiling.timer("watched.daemon.sync"):
+                remote.sync(self.remote_db, movies, replace_existing=True, watched=True)
+        except PyMongoError as e:
+            self.log(f"Failed syncing {len(movies)} movies, will retry: {e}")
+            return False
+        self.log(f"Synced {len(movies)} movies: {_summarize(movies)}")
+        return True
+
+    def _unwatch(self, imdb_ids: Set[str]) -> bool:
+        from pymongo.errors import PyMongoError
+
+        from .. import remote
+
+        try:
+            remote.unwatch(self.remote_db, imdb_ids)
+        except PyMongoError as e:
+            self.log(f"Failed unwatching {len(imdb_ids)} movies, will retry: {e}")
+            self._last_event = time.monotonic()
+            return False
+        self.log(f"Unwatched {len(imdb_ids)} movies: {_summarize(sorted(imdb_ids))}")
+        return True
+
+
+def _contents_signature(path: str) -> Optional[FrozenSet]:
+    """
+    Names, sizes and modification times of the files of a movie dir (but our own cache file),
+    None when unreadable
+    """
+    try:
+        with os.scandir(path) as entries:
+            return frozenset(
+                _entry_signature(e) for e in entries if e.name != CACHE_FILE_NAME
+            )
+    except OSError:
+        return None
+
+
+def _entry_signature(entry: os.DirEntry) -> Tuple[str, int, int]:
+    stat = entry.stat()
+    return entry.name, stat.st_size, stat.st_mtime_ns
+
+
+def _summarize(items: List, limit: int = 10) -> str:
+    res = ", ".join(map(str, items[:limit]))
+    return res + ", ..." if len(items) > limit else res
@@ -2,13 +2,19 @@ from __future__ import annotations
 
 import os
 import sqlite3
+import typing
 import urllib.parse
 from typing import Iterable, Optional
 
+from .. import profiling
 from ..localdb import MovieLookupError, fuzzy_find_in_db, get_by_id, optional_connect
 from ..models import Movie
 from . import cache
 from .local_info import collect_local_info
+from .resolutions import MATCHED
+
+if typing.TYPE_CHECKING:
+    from .resolutions import Resolution, Resolutions
 
 
 def _list_movies_dirs(movies_dir: str) -> Iterable[str]:
@@ -16,10 +22,36 @@ def _list_movies_dirs(movies_dir: str) -> Iterable[str]:
     return filter(os.path.isdir, paths)
 
 
+def list_movies_paths(movies_dirs: Iterable[str]) -> Iterable[str]:
+    for movies_dir in movies_dirs:
+        yield from _list_movies_dirs(movies_dir)
+
+
 def list_movies_local_info(movies_dir: str) -> Iterable[Movie]:
     return map(collect_local_info, _list_movies_dirs(movies_dir))
 
 
+def collect_full_info(
+    movie_dir_path: str,
+    *,
+    interactive: bool = False,
+    conn: Optional[sqlite3.Connection] = None,
+    auto_open_web: bool = False,
+    resolutions: Optional[Resolutions] = None,
+) -> Movie:
+    """
+    Collects local info about a single movie dir and merges it with its IMDB match
+    """
+    with optional_connect(conn) as conn:
+        return _merge_imdb_info(
+            collect_local_info(movie_dir_path),
+            interactive=interactive,
+            conn=conn,
+            auto_open_web=auto_open_web,
+            resolutions=resolutions,
+        )
+
+
 def list_movies_dirs(movies_dirs: Iterable[str], **kwargs) -> Iterable[Movie]:
     for movies_dir in movies_dirs:
         for movie in list_movies_full_info(movies_dir, **kwargs):
@@ -32,15 +64,24 @@ def list_movies_full_info(
     interactive: bool = False,
     conn: Optional[sqlite3.Connection] = None,
     auto_open_web: bool = False,
+    resolutions: Optional[Resolutions] = None,
 ) -> Iterable[Movie]:
     with optional_connect(conn) as conn:
         for movie in list_movies_local_info(movies_dir):
-            imdb_movie = _find_imdb_movie(
-                movie, interactive=interactive, conn=conn, auto_open_web=auto_open_web
+            yield _merge_imdb_info(
+                movie,
+                interactive=interactive,
+                conn=conn,
+                auto_open_web=auto_open_web,
+                resolutions=resolutions,
             )
-            assert movie.path
-            cache.cache_imdb_id(imdb_movie.id, movie.path)
-            yield movie.merge(imdb_movie)
+
+
+def _merge_imdb_info(movie: Movie, **kwargs) -> Movie:
+    imdb_movie = _find_imdb_movie(movie, **kwargs)
+    assert movie.path
+    cache.cache_imdb_id(imdb_movie.id, movie.path)
+    return movie.merge(imdb_movie)
 
 
 def _find_imdb_movie(
@@ -49,26 +90,73 @@ def _find_imdb_movie(
     interactive: bool = False,
     conn: Optional[sqlite3.Connection] = None,
     auto_open_web: bool = False,
+    resolutions: Optional[Resolutions] = None,
 ) -> Movie:
     """
     Tries its best to find an imdb match for local movie.
-    Tryies cache, fuzzy searching and user input, raises exception on failure.
+    Tryies cache, previous resolutions, fuzzy searching and user input,
+    raises exception on failure (caused by the lookup error).
     """
     assert movie.path
     if cache.has(movie.path):
-        return get_by_id(cache.load_imdb_id(movie.path))
+        profiling.count("watched.cache_hit")
+        return get_by_id(cache.load_imdb_id(movie.path), conn=conn)
 
     try:
+        imdb_movie = _resolve_imdb_movie(movie, conn=conn, resolutions=resolutions)
+        profiling.count("watched.exact_hit")
+        return imdb_movie
+    except MovieLookupError as e:
+        profiling.count("watched.miss")
+        if not interactive:
+            raise MovieLookupError(f"Could not find {movie} in any way") from e
+    # The user's answer is cached in the movie dir
+    return _ask_user_for_imdb_id(movie, conn=conn, auto_open_web=auto_open_web)
+
+
+def _resolve_imdb_movie(
+    movie: Movie,
+    *,
+    conn: Optional[sqlite3.Connection] = None,
+    resolutions: Optional[Resolutions] = None,
+) -> Movie:
+    """
+    fuzzy_find_in_db, memoized by resolutions (when given) including its failures
+    """
+    if not resolutions:
         return fuzzy_find_in_db(
             title=movie.title, start_year=movie.start_year, conn=conn
         )
-    except MovieLookupError:
-        if interactive:
-            return _ask_user_for_imdb_id(movie, auto_open_web=auto_open_web)
-    raise MovieLookupError(f"Could not find {movie} in any way")
+    resolution = resolutions.get(movie)
+    if resolution:
+        profiling.count("watched.resolution_hit")
+        return _from_resolution(movie, resolution, conn=conn)
+    try:
+        imdb_movie = fuzzy_find_in_db(
+            title=movie.title, start_year=movie.start_year, conn=conn
+        )
+    except MovieLookupError as e:
+        resolutions.record_error(movie, e)
+        raise
+    resolutions.record_match(movie, imdb_movie.id)
+    return imdb_movie
+
 
+def _from_resolution(
+    movie: Movie, resolution: Resolution, *, conn: Optional[sqlite3.Connection]
+) -> Movie:
+    if resolution.status != MATCHED:
+        # A known failure, no need to look it up again
+        raise resolution.to_error(movie)
+    return get_by_id(resolution.ids[0], conn=conn)
 
-def _ask_user_for_imdb_id(movie: Movie, auto_open_web: bool = False) -> Movie:
+
+def _ask_user_for_imdb_id(
+    movie: Movie,
+    *,
+    conn: Optional[sqlite3.Connection] = None,
+    auto_open_web: bool = False,
+) -> Movie:
     import click
 
     url = _suggest_google_search(movie)
@@ -79,7 +167,7 @@ def _ask_user_for_imdb_id(movie: Movie, auto_open_web: bool = False) -> Movie:
     imdb_id = click.prompt(
         f'Please enter the IMDB id for {movie} (try looking in "{url}")'
     )
-    imdb_movie = get_by_id(imdb_id)
+    imdb_movie = get_by_id(imdb_id, conn=conn)
     if click.confirm(f"Got {imdb_movie!r}. Correct?", default=True):
         return imdb_movie
     else:
@@ -7,6 +7,7 @@ import string
 import typing
 from contextlib import contextmanager
 
+from .. import profiling
 from ..models import Movie
 
 if typing.TYPE_CHECKING:
@@ -23,6 +24,7 @@ class MovieDirNameParseError(ValueError):
     pass
 
 
+@profiling.timed("watched.collect_local_info")
 def collect_local_info(movie_dir_path: str) -> Movie:
     """
     Collects all local info about give movie, without consulting IMDN
@@ -0,0 +1,144 @@
+"""
+Persistent memo of IMDB resolution outcomes (matched, ambiguous or not found) of local movies,
+keyed by their parsed title and year.
+Outcomes are only valid for the localdb version they were resolved against,
+so after a rebuild everything is resolved again.
+"""
+from __future__ import annotations
+
+import json
+import os
+import typing
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from ..localdb import MovieNotFound, MultipleMoviesFound
+from ..models import normalize_title
+
+if typing.TYPE_CHECKING:
+    import sqlite3
+    from typing import Dict, Iterator, List, Optional
+
+    from ..localdb import MovieLookupError
+    from ..models import Movie
+
+__all__ = [
+    "RESOLUTIONS_FILE_NAME",
+    "MATCHED",
+    "AMBIGUOUS",
+    "NOT_FOUND",
+    "Resolution",
+    "Resolutions",
+    "get_resolutions_path",
+    "load",
+    "save",
+    "open_resolutions",
+]
+RESOLUTIONS_FILE_NAME = "resolutions.json"
+MATCHED = "matched"
+AMBIGUOUS = "ambiguous"
+NOT_FOUND = "not_found"
+
+
+@dataclass(frozen=True)
+class Resolution:
+    status: str
+    # The matched id, or the ambiguous candidates
+    ids: List[str] = field(default_factory=list)
+
+    def to_error(self, movie: Movie) -> MovieLookupError:
+        message = f"Previously failed to resolve: {movie.title} ({movie.start_year})"
+        if self.status == AMBIGUOUS:
+            return MultipleMoviesFound(message, candidates=self.ids)
+        return MovieNotFound(message)
+
+    @classmethod
+    def from_error(cls, error: MovieLookupError) -> Resolution:
+        if isinstance(error, MultipleMoviesFound):
+            return cls(AMBIGUOUS, error.candidates)
+        return cls(NOT_FOUND)
+
+
+def _key(movie: Movie) -> str:
+    return f"{normalize_title(movie.title)}|{movie.start_year}"
+
+
+class Resolutions:
+    def __init__(
+        self, version: Optional[int], entries: Optional[Dict[str, Resolution]] = None
+    ):
+        self.version = version
+        self.entries = entries or {}
+        self.dirty = False
+
+    def get(self, movie: Movie) -> Optional[Resolution]:
+        return self.entries.get(_key(movie))
+
+    def record(self, movie: Movie, resolution: Resolution):
+        key = _key(movie)
+        if self.entries.get(key) != resolution:
+            self.entries[key] = resolution
+            self.dirty = True
+
+    def record_match(self, movie: Movie, imdb_id: str):
+        self.record(movie, Resolution(MATCHED, [imdb_id]))
+
+    def record_error(self, movie: Movie, error: MovieLookupError):
+        self.record(movie, Resolution.from_error(error))
+
+
+def get_resolutions_path(file_name: str = RESOLUTIONS_FILE_NAME) -> str:
+    import click
+
+    from ..config import CONFIG_DIR
+
+    return os.path.join(click.get_app_dir(CONFIG_DIR), file_name)
+
+
+def load(version: Optional[int], path: Optional[str] = None) -> Resolutions:
+    """
+    The stored resolutions, empty when missing, unreadable or of another DB version
+    """
+    try:
+        with open(path or get_resolutions_path(), "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return Resolutions(version)
+    if data.get("version") != version:
+        return Resolutions(version)
+    entries = {
+        key: Resolution(entry["status"], entry["ids"])
+        for key, entry in data["entries"].items()
+    }
+    return Resolutions(version, entries)
+
+
+def save(resolutions: Resolutions, path: Optional[str] = None):
+    path = path or get_resolutions_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entries = {
+        key: dict(status=r.status, ids=r.ids) for key, r in resolutions.entries.items()
+    }
+    with open(path, "w") as f:
+        json.dump(dict(version=resolutions.version, entries=entries), f)
+    resolutions.dirty = False
+
+
+@contextmanager
+def open_resolutions(
+    conn: sqlite3.Connection, path: Optional[str] = None
+) -> Iterator[Optional[Resolutions]]:
+    """
+    Loads the resolutions of the DB of conn and saves them back (if changed) on exit.
+    Unversioned DBs can't invalidate resolutions, so they get None (no memo).
+    """
+    version = getattr(conn, "version", None)
+    if version is None:
+        yield None
+        return
+    resolutions = load(version, path)
+    try:
+        yield resolutions
+    finally:
+        if resolutions.dirty:
+            save(resolutions, path)
@@ -0,0 +1,180 @@
+"""
+Scan files: the local info of movie dirs (and their cached IMDB ids), collected on the host
+that has the movie dirs, to be resolved and synced from another host (see merge).
+A gzipped JSON document with format, version, host, creation time, movies and scan errors.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import gzip
+import json
+import socket
+import typing
+from dataclasses import dataclass, field
+
+from .. import profiling
+from ..localdb import MovieLookupError, get_by_id, optional_connect
+from ..models import Movie
+from . import cache
+from .full_info import _resolve_imdb_movie, list_movies_paths
+from .local_info import collect_local_info
+
+if typing.TYPE_CHECKING:
+    import sqlite3
+    from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+    from .resolutions import Resolutions
+
+__all__ = [
+    "SCAN_FORMAT",
+    "SCAN_VERSION",
+    "InvalidScan",
+    "Scan",
+    "scan_movies_dirs",
+    "save",
+    "load",
+    "merge",
+]
+SCAN_FORMAT = "iamdb-scan"
+SCAN_VERSION = 1
+# Local info only, the rest comes from IMDB when merging
+_FIELDS = (
+    "id",
+    "title",
+    "start_year",
+    "path",
+    "quality",
+    "first_watch_time",
+    "subtitles_languages",
+)
+
+
+class InvalidScan(ValueError):
+    pass
+
+
+@dataclass
+class Scan:
+    host: str
+    created: dt.datetime
+    movies: List[Movie] = field(default_factory=list)
+    # Movie dir path -> why it couldn't be scanned
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+def scan_movies_dirs(movies_dirs: Iterable[str]) -> Scan:
+    """
+    Collects the local info of all movie dirs, with their cached IMDB ids (if any)
+    """
+    res = Scan(host=socket.gethostname(), created=dt.datetime.now())
+    for path in list_movies_paths(movies_dirs):
+        try:
+            movie = collect_local_info(path)
+            if cache.has(path):
+                movie = movie.replace(id=cache.load_imdb_id(path))
+        # Unparsable dir names, unreadable subtitles, broken caches
+        except (ValueError, OSError, KeyError) as e:
+            res.errors[path] = str(e)
+            continue
+        res.movies.append(movie)
+    return res
+
+
+def _movie_to_record(movie: Movie) -> Dict[str, Any]:
+    record = {name: getattr(movie, name) for name in _FIELDS}
+    if movie.first_watch_time:
+        record["first_watch_time"] = movie.first_watch_time.isoformat()
+    return {name: value for name, value in record.items() if value}
+
+
+def _record_to_movie(record: Dict[str, Any]) -> Movie:
+    first_watch_time = record.get("first_watch_time")
+    if first_watch_time:
+        record = dict(
+            record, first_watch_time=dt.datetime.fromisoformat(first_watch_time)
+        )
+    return Movie(**record)
+
+
+def save(scan: Scan, path: str):
+    data = dict(
+        format=SCAN_FORMAT,
+        version=SCAN_VERSION,
+        host=scan.host,
+        created=scan.created.isoformat(),
+        movies=list(map(_movie_to_record, scan.movies)),
+        errors=scan.errors,
+    )
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+
+
+def load(path: str) -> Scan:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise InvalidScan(f"Can't read scan {path}: {e}") from e
+    if data.get("format") != SCAN_FORMAT or data.get("version") != SCAN_VERSION:
+        raise InvalidScan(
+            f"Unsupported scan {path}: {data.get('format')} v{data.get('version')}"
+        )
+    return Scan(
+        host=data["host"],
+        created=dt.datetime.fromisoformat(data["created"]),
+        movies=list(map(_record_to_movie, data["movies"])),
+        errors=data["errors"],
+    )
+
+
+def merge(
+    scans: Iterable[Scan],
+    *,
+    conn: Optional[sqlite3.Connection] = None,
+    resolutions: Optional[Resolutions] = None,
+) -> Tuple[List[Movie], List[Tuple[str, MovieLookupError]]]:
+    """
+    Resolves the movies of all scans against IMDB, deduplicated by IMDB id
+    (the same movie on several hosts is watched since the earliest watch, with all subtitles).
+    Returns the movies and the "host:path" and lookup error of every unresolved movie.
+    """
+    movies: Dict[str, Movie] = {}
+    failures = []
+    with optional_connect(conn) as conn:
+        for scan in scans:
+            for movie in scan.movies:
+                try:
+                    movie = movie.merge(
+                        _resolve_scanned(movie, conn=conn, resolutions=resolutions)
+                    )
+                except MovieLookupError as e:
+                    failures.append((f"{scan.host}:{movie.path}", e))
+                    continue
+                movies[movie.id] = _merge_copies(movies.get(movie.id), movie)
+    return list(movies.values()), failures
+
+
+def _resolve_scanned(
+    movie: Movie,
+    *,
+    conn: sqlite3.Connection,
+    resolutions: Optional[Resolutions] = None,
+) -> Movie:
+    if movie.id:
+        # Resolved (and cached) on the scanning host
+        profiling.count("watched.cache_hit")
+        return get_by_id(movie.id, conn=conn)
+    return _resolve_imdb_movie(movie, conn=conn, resolutions=resolutions)
+
+
+def _merge_copies(movie: Optional[Movie], other: Movie) -> Movie:
+    if movie is None:
+        return other
+    profiling.count("watched.scan.duplicate")
+    watch_times = [m.first_watch_time for m in (movie, other) if m.first_watch_time]
+    return movie.replace(
+        first_watch_time=min(watch_times, default=None),
+        subtitles_languages=sorted(
+            {*movie.subtitles_languages, *other.subtitles_languages}
+        ),
+    )
@@ -5,5 +5,6 @@ setup(
     version="0.1.0",
     packages=find_packages(),
     install_requires=["click", "click-config-file", "pymongo", "keyring"],
+    extras_require={"analytics": ["numpy"], "export": ["pyarrow"]},
     entry_points={"console_scripts": ["iamdb=iamdb.cli:cli"]},
 )